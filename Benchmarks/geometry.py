@@ -0,0 +1,109 @@
+"""
+Benchmark of the vectorized geometry stage against the former per-frame loop of Analyzer.df_Loader
+
+Run from the project root:
+    python -m Benchmarks.geometry
+    python -m Benchmarks.geometry --frames 10000 100000 --reference-limit 100000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from Libs.calculations import GeometryCalculator
+
+
+HEART_COLUMNS = [f"heart{num}_{axis}" for num in [1, 3, 5, 7] for axis in ["x", "y"]]
+
+
+def make_cleaned_df(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {column: rng.uniform(100, 400, frames) for column in HEART_COLUMNS}
+    return pd.DataFrame(data)
+
+
+def reference_geometry(cleaned_df, conversion_rate):
+    # Former implementation of Analyzer.df_Loader, kept here to check the numbers and measure the speedup
+    LAD_in_pixel = []
+    LAD_in_mm = []
+    SAD_in_pixel = []
+    SAD_in_mm = []
+    Heart_Volumes_in_mm3 = []
+    Heart_Volumes_in_pL = []
+
+    for i in range(len(cleaned_df)):
+        h5x = cleaned_df.iloc[i]["heart5_x"]
+        h5y = cleaned_df.iloc[i]["heart5_y"]
+        h1x = cleaned_df.iloc[i]["heart1_x"]
+        h1y = cleaned_df.iloc[i]["heart1_y"]
+        long_axis_distance_pixel = np.sqrt((h5x - h1x)**2 + (h5y - h1y)**2)
+        long_axis_distance_mm = long_axis_distance_pixel / conversion_rate
+        LAD_in_pixel.append(long_axis_distance_pixel)
+        LAD_in_mm.append(long_axis_distance_mm)
+
+        h7x = cleaned_df.iloc[i]["heart7_x"]
+        h7y = cleaned_df.iloc[i]["heart7_y"]
+        h3x = cleaned_df.iloc[i]["heart3_x"]
+        h3y = cleaned_df.iloc[i]["heart3_y"]
+        short_axis_distance_pixel = np.sqrt((h7x - h3x)**2 + (h7y - h3y)**2)
+        short_axis_distance_mm = short_axis_distance_pixel / conversion_rate
+        SAD_in_pixel.append(short_axis_distance_pixel)
+        SAD_in_mm.append(short_axis_distance_mm)
+
+        Heart_Volume = 1/6 * np.pi * long_axis_distance_mm * short_axis_distance_mm**2
+        Heart_Volumes_in_mm3.append(Heart_Volume)
+        Heart_Volumes_in_pL.append(Heart_Volume * 10**6)
+
+    return {
+        "LAD_in_pixel": LAD_in_pixel,
+        "LAD_in_mm": LAD_in_mm,
+        "SAD_in_pixel": SAD_in_pixel,
+        "SAD_in_mm": SAD_in_mm,
+        "Heart_Volumes_in_mm3": Heart_Volumes_in_mm3,
+        "Heart_Volumes_in_pL": Heart_Volumes_in_pL,
+    }
+
+
+def run(frames_list, conversion_rate=2200, reference_limit=None):
+    rows = []
+    for frames in frames_list:
+        cleaned_df = make_cleaned_df(frames)
+
+        start = time.perf_counter()
+        geometry = GeometryCalculator(cleaned_df, conversion_rate)
+        vectorized_time = time.perf_counter() - start
+
+        reference_time = None
+        if reference_limit is None or frames <= reference_limit:
+            start = time.perf_counter()
+            reference = reference_geometry(cleaned_df, conversion_rate)
+            reference_time = time.perf_counter() - start
+
+            for key, values in reference.items():
+                if not np.array_equal(geometry[key], np.array(values)):
+                    raise AssertionError(f"{key} differs from the reference implementation at {frames} frames")
+
+        rows.append({
+            "frames": frames,
+            "reference_s": reference_time,
+            "vectorized_s": vectorized_time,
+            "speedup": reference_time / vectorized_time if reference_time else None,
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Analyzer.df_Loader geometry")
+    parser.add_argument("--frames", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--reference-limit", type=int, default=None,
+                        help="Skip the (slow) per-frame reference above this many frames")
+    args = parser.parse_args()
+
+    for row in run(args.frames, reference_limit=args.reference_limit):
+        if row["reference_s"] is None:
+            print(f"{row['frames']:>10} frames | reference skipped | vectorized {row['vectorized_s']:.4f}s")
+        else:
+            print(f"{row['frames']:>10} frames | reference {row['reference_s']:.3f}s | "
+                  f"vectorized {row['vectorized_s']:.4f}s | speedup x{row['speedup']:.0f}")
@@ -0,0 +1,84 @@
+"""
+Randomized equivalence check and benchmark of the PeakFinder backends
+
+The repository has no test suite: this script is not run automatically, run it after changing a backend.
+It exits with an error if a backend differs from the reference ("python") on any random signal.
+
+Run from the project root:
+    python -m Benchmarks.peak_finder
+    python -m Benchmarks.peak_finder --trials 500 --frames 10000 100000
+    python -m Benchmarks.peak_finder --check-only
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from Libs.calculations import PEAK_BACKENDS, NUMBA_AVAILABLE
+
+
+EDGE_MODES = [0, 1, 2] # include edge, exclude edge, circular
+
+
+def random_signal(rng, length):
+    kind = rng.integers(3)
+    if kind == 0:
+        # Noisy beats
+        t = np.arange(length)
+        return np.sin(2 * np.pi * t / rng.uniform(5, 40)) + rng.normal(0, rng.uniform(0.01, 0.5), length)
+    if kind == 1:
+        # Coarsely quantized values, to produce plateaus and ties
+        return rng.integers(0, 5, length).astype(float)
+    return rng.normal(0, 1, length)
+
+
+def check_equivalence(trials, seed=0):
+    rng = np.random.default_rng(seed)
+    reference = PEAK_BACKENDS["python"]
+    for name, backend in PEAK_BACKENDS.items():
+        if name == "python":
+            continue
+        for trial in range(trials):
+            yvalues = random_signal(rng, int(rng.integers(0, 300)))
+            tolerance = rng.choice([0, rng.uniform(0, 2), -1])
+            edge_mode = EDGE_MODES[trial % len(EDGE_MODES)]
+            for ref_finder, finder in zip(reference, backend):
+                expected = np.asarray(ref_finder(yvalues, tolerance, edge_mode, None), dtype=int)
+                result = np.asarray(finder(yvalues, tolerance, edge_mode, None), dtype=int)
+                if not np.array_equal(expected, result):
+                    raise AssertionError(f"Backend '{name}' differs from the reference "
+                                         f"(trial {trial}, edge mode {edge_mode}, tolerance {tolerance})")
+        print(f"Backend '{name}' matches the reference on {trials} random signals")
+
+
+def run(frames_list, tolerance=0.5):
+    rng = np.random.default_rng(1)
+    rows = []
+    for frames in frames_list:
+        yvalues = np.sin(2 * np.pi * np.arange(frames) / 15) + rng.normal(0, 0.1, frames)
+        row = {"frames": frames}
+        for name, (maxima_finder, minima_finder) in PEAK_BACKENDS.items():
+            maxima_finder(yvalues[:100], tolerance, 0, None) # warm up (numba compilation)
+            start = time.perf_counter()
+            maxima_finder(yvalues, tolerance, 0, None)
+            minima_finder(yvalues, tolerance, 0, None)
+            row[f"{name}_s"] = time.perf_counter() - start
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the PeakFinder backends")
+    parser.add_argument("--trials", type=int, default=300)
+    parser.add_argument("--frames", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--check-only", action="store_true", help="only run the equivalence check, without the benchmark")
+    args = parser.parse_args()
+
+    print(f"numba available: {NUMBA_AVAILABLE}")
+    check_equivalence(args.trials)
+    if args.check_only:
+        raise SystemExit(0)
+    for row in run(args.frames):
+        timings = " | ".join(f"{key[:-2]} {value:.3f}s" for key, value in row.items() if key != "frames")
+        print(f"{row['frames']:>10} frames | {timings}")
@@ -0,0 +1,174 @@
+"""
+Stage by stage benchmark of the whole pipeline on synthetic recordings (see Benchmarks/synthetic.py)
+
+Times Reader.DataCleaner, Analyzer.df_Loader, Analyzer.Peak_Finder (PeakFinder), Analyzer.EndPoints_Calculator,
+Analyzer.EndPoints_Updater and Analyzer.SavePeaks (draw_peaks, mode="save") separately, for every combination
+of --frames and --files, and prints (or writes) the results as JSON
+
+Times are summed over the files of a run. Peak memory (tracemalloc, so numpy and Python allocations)
+is measured in a separate pass over the first file, because tracing slows the Python-heavy stages down
+
+Run from the project root:
+    python -m Benchmarks.pipeline
+    python -m Benchmarks.pipeline --frames 1000 100000 10000000 --files 1 100 1000 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from Libs import HEART_BODYPARTS
+from Libs.analyzer import Analyzer
+from Libs.calculations import NUMBA_AVAILABLE
+from Libs.reader import Reader
+from Benchmarks.synthetic import write_dataset
+
+STAGES = ["DataCleaner", "df_Loader", "PeakFinder", "EndPoints_Calculator", "EndPoints_Updater", "draw_peaks"]
+
+
+class PreparsedCache():
+    # Hands the coordinates parsed by the DataCleaner stage to Analyzer, so the file is not parsed twice
+    def __init__(self, coords):
+        self.coords = coords
+
+    def load(self, given_path):
+        return self.coords
+
+    def save(self, given_path, arrays):
+        pass
+
+
+@contextmanager
+def working_directory(path):
+    # Output/ (summary, store, plots) is relative to the working directory
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def run_file(given_path, PARAMS, measure):
+    """
+    Runs every stage on one file, returns {stage: measure(stage function)}
+    """
+
+    results = {}
+    state = {}
+
+    def data_cleaner():
+        reader = Reader(given_paths=[given_path])
+        core_name, file_path = list(reader.file_paths_dict.items())[0]
+        df = reader.DataCleaner(file_path, bodyparts=HEART_BODYPARTS, likelihood=True)
+        state["coords"] = Analyzer.cleaner(df)
+
+    results["DataCleaner"] = measure(data_cleaner)
+
+    analyzer = Analyzer(str(given_path), PARAMS, cache=PreparsedCache(state["coords"]))
+
+    results["df_Loader"] = measure(analyzer.df_Loader)
+    results["PeakFinder"] = measure(analyzer.Peak_Finder)
+    results["EndPoints_Calculator"] = measure(analyzer.EndPoints_Calculator)
+    results["EndPoints_Updater"] = measure(analyzer.EndPoints_Updater)
+    results["draw_peaks"] = measure(analyzer.SavePeaks)
+
+    return results
+
+
+def measure_time(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def measure_memory(function):
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    function()
+    return tracemalloc.get_traced_memory()[1] - before
+
+
+def run(frames_list, files_list, file_format="csv", memory=True, conversion_rate=2200, frame_rate=30):
+    PARAMS = {"CONVERSION RATE": conversion_rate, "FRAME RATE": frame_rate}
+    rows = []
+
+    with tempfile.TemporaryDirectory(prefix="cpad-bench-") as temp_dir:
+        for frames in frames_list:
+            # One dataset per length, each run uses its first `files` files
+            data_dir = os.path.join(temp_dir, f"data-{frames}")
+            paths = write_dataset(data_dir, max(files_list), frames, file_format, frame_rate=frame_rate)
+
+            peak_bytes = {}
+            if memory:
+                memory_dir = os.path.join(temp_dir, f"memory-{frames}")
+                os.makedirs(memory_dir)
+                with working_directory(memory_dir):
+                    tracemalloc.start()
+                    try:
+                        peak_bytes = run_file(paths[0], dict(PARAMS), measure_memory)
+                    finally:
+                        tracemalloc.stop()
+
+            for files in files_list:
+                # A fresh directory per run, as draw_peaks skips plots that already exist
+                run_dir = os.path.join(temp_dir, f"run-{frames}-{files}")
+                os.makedirs(run_dir)
+
+                seconds = {stage: 0.0 for stage in STAGES}
+                with working_directory(run_dir):
+                    for given_path in paths[:files]:
+                        for stage, value in run_file(given_path, dict(PARAMS), measure_time).items():
+                            seconds[stage] += value
+
+                rows.append({
+                    "frames": frames,
+                    "files": files,
+                    "format": file_format,
+                    "total_seconds": sum(seconds.values()),
+                    "stages": {stage: {"seconds": seconds[stage],
+                                       "seconds_per_file": seconds[stage] / files,
+                                       "peak_bytes": peak_bytes.get(stage)} for stage in STAGES},
+                })
+                print(f"{frames:>10} frames x {files:>5} files: {rows[-1]['total_seconds']:.3f}s", file=sys.stderr)
+
+    return rows
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "numba": NUMBA_AVAILABLE,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the analysis")
+    parser.add_argument("--frames", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--files", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory pass")
+    parser.add_argument("--output", default=None, help="JSON file to write (default: stdout)")
+    args = parser.parse_args()
+
+    report = {"environment": environment(),
+              "results": run(args.frames, args.files, args.format, memory=not args.no_memory)}
+
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
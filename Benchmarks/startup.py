@@ -0,0 +1,136 @@
+"""
+Startup time budget of the GUI and of the headless analysis API, measured with python -X importtime
+
+    - importing main.py (everything before the window is built) must stay under --budget seconds
+      and must not load the heavy modules, which are imported on first use
+    - importing the headless API (Libs.analyzer, Libs.batch, cli) must not load any GUI module
+
+Each import runs in a fresh interpreter, in a scratch working directory, and is repeated --repeat times
+(the best time is kept, as the first run also fills the OS file cache). Exits with 1 when a check fails
+
+Run from the project root:
+    python -m Benchmarks.startup
+    python -m Benchmarks.startup --budget 0.3 --top 15 --output startup.json
+    python -m Benchmarks.startup --window      (also time until the window is drawn, needs a display)
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use only, never when main.py starts
+HEAVY_MODULES = ["numpy", "pandas", "openpyxl", "matplotlib", "numba"]
+# Never loaded by the headless API
+GUI_MODULES = ["tkinter", "_tkinter", "matplotlib.backends.backend_tkagg", "colorlog", "Libs.customwidgets"]
+HEADLESS_MODULES = ["Libs.analyzer", "Libs.batch", "cli"]
+
+
+def run_python(code, cwd, *flags):
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=cwd, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def parse_importtime(stderr):
+    """
+    {module: (self seconds, cumulative seconds)} from the output of -X importtime
+    """
+
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return modules
+
+
+def measure_import(module, cwd, repeat=3, top=10):
+    """
+    Best cumulative import time of module over `repeat` fresh interpreters, its slowest imports, and the modules it loads
+    """
+
+    best = None
+    for _ in range(repeat):
+        modules = parse_importtime(run_python(f"import {module}", cwd, "-X", "importtime").stderr)
+        if best is None or modules[module][1] < best[module][1]:
+            best = modules
+
+    loaded = json.loads(run_python(f"import sys, json, {module}; print(json.dumps(sorted(sys.modules)))", cwd).stdout)
+
+    # Slowest top level packages, by cumulative time
+    packages = {}
+    for name, (_, cumulative) in best.items():
+        package = name.lstrip().split(".")[0]
+        packages[package] = max(packages.get(package, 0), cumulative)
+
+    return {
+        "module": module,
+        "seconds": best[module][1],
+        "slowest": sorted(packages.items(), key=lambda item: -item[1])[:top],
+        "loaded": loaded,
+    }
+
+
+def measure_window(cwd):
+    # Import main, build the window and draw it once
+    code = ("import time; start = time.perf_counter(); import main; app = main.Application(); app.update(); "
+            "print(time.perf_counter() - start); app.destroy()")
+    return float(run_python(code, cwd).stdout.strip().splitlines()[-1])
+
+
+def loaded_from(loaded, names):
+    return sorted(name for name in loaded if any(name == wanted or name.startswith(wanted + ".") for wanted in names))
+
+
+def run(budget=0.5, repeat=3, top=10, window=False):
+    report = {"budget_s": budget, "checks": {}}
+
+    with tempfile.TemporaryDirectory(prefix="cpad-startup-") as cwd:
+        gui = measure_import("main", cwd, repeat, top)
+        heavy = loaded_from(gui["loaded"], HEAVY_MODULES)
+        report["main"] = {"seconds": gui["seconds"], "slowest": gui["slowest"], "heavy_modules_loaded": heavy}
+        report["checks"]["main import within budget"] = gui["seconds"] <= budget
+        report["checks"]["main loads no heavy module"] = not heavy
+
+        if window:
+            report["main"]["window_seconds"] = measure_window(cwd)
+            report["checks"]["window within budget"] = report["main"]["window_seconds"] <= budget
+
+        report["headless"] = {}
+        for module in HEADLESS_MODULES:
+            headless = measure_import(module, cwd, repeat, top)
+            gui_loaded = loaded_from(headless["loaded"], GUI_MODULES)
+            report["headless"][module] = {"seconds": headless["seconds"], "slowest": headless["slowest"], "gui_modules_loaded": gui_loaded}
+            report["checks"][f"{module} loads no GUI module"] = not gui_loaded
+
+    report["ok"] = all(report["checks"].values())
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the startup time budget")
+    parser.add_argument("--budget", type=float, default=0.5, help="seconds allowed to import main.py (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument("--window", action="store_true", help="also time until the window is drawn (needs a display)")
+    parser.add_argument("--output", default=None, help="JSON file to write (default: stdout)")
+    args = parser.parse_args()
+
+    report = run(args.budget, args.repeat, args.top, args.window)
+
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    for check, passed in report["checks"].items():
+        print(f"{'ok  ' if passed else 'FAIL'} {check}", file=sys.stderr)
+
+    sys.exit(0 if report["ok"] else 1)
@@ -0,0 +1,154 @@
+"""
+Synthetic DeepLabCut recordings, for benchmarks
+
+heart1 to heart8 sit on an ellipse (heart1/heart5 on the long axis, heart3/heart7 on the short axis)
+that contracts once per beat. Beat intervals vary by `jitter` (relative std) and every point gets
+gaussian tracking `noise` in pixels, so the files look like real recordings to the whole pipeline
+
+Run from the project root:
+    python -m Benchmarks.synthetic Data/synthetic --files 10 --frames 100000
+    python -m Benchmarks.synthetic Data/synthetic --files 1 --frames 5000 --format xlsx --heart-rate 150
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BODYPARTS = [f"heart{num}" for num in range(1, 9)]
+COORDS = ["x", "y", "likelihood"]
+SCORER = "DLC_resnet50_heartSyntheticshuffle1_100000"
+
+# Excel sheets are limited to 1048576 rows, minus the 3 header rows
+XLSX_MAX_FRAMES = 1048576 - 3
+
+
+def beat_phase(frames, heart_rate=150, frame_rate=30, jitter=0.05, rng=None):
+    """
+    Phase (in beats) of every frame, heart_rate in beats per minute
+    Each beat interval is 60 / heart_rate seconds, times (1 + jitter * standard normal)
+    """
+
+    rng = rng if rng is not None else np.random.default_rng()
+
+    mean_interval = 60 / heart_rate * frame_rate # in frames
+    beats = int(frames / mean_interval * 1.5) + 2
+    intervals = mean_interval * np.clip(1 + jitter * rng.standard_normal(beats), 0.2, None)
+    beat_starts = np.concatenate([[0], np.cumsum(intervals)])
+
+    return np.interp(np.arange(frames), beat_starts, np.arange(len(beat_starts)))
+
+
+def make_recording(frames, heart_rate=150, frame_rate=30, jitter=0.05, noise=0.3,
+                   long_axis=60, short_axis=30, contraction=0.15, center=(200, 200), dropouts=0, seed=0):
+    """
+    (frames x 24) array of x, y, likelihood for heart1 to heart8, in the DeepLabCut column order
+    dropouts is the number of tracking losses per 1000 frames and bodypart: runs of 1 to 20 frames
+    with a likelihood under 0.5 and the point off the heart outline
+    """
+
+    rng = np.random.default_rng(seed)
+
+    phase = beat_phase(frames, heart_rate, frame_rate, jitter, rng)
+    # 1 at end-diastole, 1 - contraction at end-systole
+    scale = 1 - contraction * (0.5 - 0.5 * np.cos(2 * np.pi * phase))
+
+    data = np.empty((frames, len(BODYPARTS) * len(COORDS)))
+    for num in range(len(BODYPARTS)):
+        angle = num * np.pi / 4
+        data[:, 3 * num] = center[0] + long_axis * scale * np.cos(angle) + rng.normal(0, noise, frames)
+        data[:, 3 * num + 1] = center[1] + short_axis * scale * np.sin(angle) + rng.normal(0, noise, frames)
+        data[:, 3 * num + 2] = rng.uniform(0.8, 1, frames)
+
+    for num in range(len(BODYPARTS) if dropouts else 0):
+        for start in rng.integers(0, frames, int(dropouts * frames / 1000)):
+            stop = start + rng.integers(1, 21)
+            data[start:stop, 3 * num:3 * num + 2] += rng.normal(0, 20, 2)
+            data[start:stop, 3 * num + 2] = rng.uniform(0, 0.5)
+
+    return data
+
+
+def header_rows():
+    return [
+        ["scorer"] + [SCORER] * len(BODYPARTS) * len(COORDS),
+        ["bodyparts"] + [bodypart for bodypart in BODYPARTS for _ in COORDS],
+        ["coords"] + [coord for _ in BODYPARTS for coord in COORDS],
+    ]
+
+
+def write_dlc_csv(given_path, frames, chunk_rows=1_000_000, seed=0, **kwargs):
+    """
+    Write a synthetic DeepLabCut csv file, chunk by chunk so that 10M+ frames fit in memory
+    kwargs are passed to make_recording
+    """
+
+    given_path = Path(given_path)
+    given_path.parent.mkdir(parents=True, exist_ok=True)
+
+    data = make_recording(frames, seed=seed, **kwargs)
+
+    with open(given_path, "w", newline="") as file:
+        for row in header_rows():
+            file.write(",".join(row) + "\n")
+        for start in range(0, frames, chunk_rows):
+            chunk = pd.DataFrame(data[start:start + chunk_rows], index=np.arange(start, min(start + chunk_rows, frames)))
+            chunk.to_csv(file, header=False, lineterminator="\n")
+
+    return given_path
+
+
+def write_dlc_xlsx(given_path, frames, seed=0, **kwargs):
+    """
+    Write a synthetic DeepLabCut xlsx file, kwargs are passed to make_recording
+    """
+
+    import openpyxl
+
+    if frames > XLSX_MAX_FRAMES:
+        raise ValueError(f"xlsx files can hold at most {XLSX_MAX_FRAMES} frames")
+
+    given_path = Path(given_path)
+    given_path.parent.mkdir(parents=True, exist_ok=True)
+
+    data = make_recording(frames, seed=seed, **kwargs)
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    for row in header_rows():
+        sheet.append(row)
+    for index, values in enumerate(data.tolist()):
+        sheet.append([index] + values)
+    workbook.save(given_path)
+
+    return given_path
+
+
+def write_dataset(directory, files, frames, file_format="csv", seed=0, **kwargs):
+    """
+    Write `files` synthetic recordings named like DeepLabCut outputs, returns their paths
+    Each file gets its own seed, so the recordings differ
+    """
+
+    writer = {"csv": write_dlc_csv, "xlsx": write_dlc_xlsx}[file_format]
+    return [writer(Path(directory) / f"fish{seed + num} DLC_resnet50_heartSynthetic.{file_format}", frames, seed=seed + num, **kwargs)
+            for num in range(files)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic DeepLabCut recordings")
+    parser.add_argument("directory")
+    parser.add_argument("--files", type=int, default=1)
+    parser.add_argument("--frames", type=int, default=10_000)
+    parser.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+    parser.add_argument("--heart-rate", type=float, default=150, help="beats per minute (default: %(default)s)")
+    parser.add_argument("--frame-rate", type=float, default=30, help="frames per second (default: %(default)s)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="relative std of the beat intervals (default: %(default)s)")
+    parser.add_argument("--noise", type=float, default=0.3, help="tracking noise in pixels (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for path in write_dataset(args.directory, args.files, args.frames, args.format, seed=args.seed,
+                              heart_rate=args.heart_rate, frame_rate=args.frame_rate, jitter=args.jitter, noise=args.noise):
+        print(path)
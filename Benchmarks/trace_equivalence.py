@@ -0,0 +1,98 @@
+"""
+Check that a .trace file (see Libs/trace.py) gives the same peaks and endpoints as the csv it was converted from,
+with every peak filter (ENTRY_NAMES_SET2) setting, on synthetic recordings (see Benchmarks/synthetic.py)
+with and without tracking losses, so that the likelihood filter is checked across windows too
+
+The trace is analyzed in windows of --window frames, so that peaks straddle window boundaries
+The repository has no test suite: this script is not run automatically. Exits with 1 when a check fails
+
+Run from the project root:
+    python -m Benchmarks.trace_equivalence
+    python -m Benchmarks.trace_equivalence --frames 100000 --window 4096
+"""
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+import Libs.trace
+from Libs import DEFAULT_VALUES
+from Libs.analyzer import Analyzer
+from Libs.trace import convert_to_trace
+from Benchmarks.synthetic import write_dlc_csv
+
+
+def filter_settings(maxima, minima):
+    """
+    (name, PARAMS overrides) covering every peak filter, alone and together,
+    with thresholds that drop part of the unfiltered peaks (PeakTables)
+    """
+
+    high = float(np.median(maxima.y))
+    low = float(np.median(minima.y))
+    prominence = float(np.median(maxima.y) - np.median(minima.y))
+    settings = [("none", {})]
+    settings += [(f"minPeakDistance {distance}", {"minPeakDistance": distance}) for distance in (3, 8, 15, 40)]
+    settings += [("minMaximaValue", {"minMaximaValue": high}),
+                 ("maxMaximaValue", {"maxMaximaValue": low}),
+                 ("minPeakProminence", {"minPeakProminence": prominence}),
+                 ("all", {"minPeakDistance": 8, "minMaximaValue": high, "maxMaximaValue": low, "minPeakProminence": prominence / 2})]
+    return settings
+
+
+def analyze(given_path, PARAMS):
+    analyzer = Analyzer(given_path, PARAMS, cache=False)
+    analyzer.df_Loader(get_tolerance=False)
+    analyzer.Peak_Finder()
+    analyzer.EndPoints_Calculator()
+    return analyzer
+
+
+def check(frames, seed=0, **kwargs):
+    """
+    Returns the list of the failed settings
+    """
+
+    failed = []
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = write_dlc_csv(Path(directory) / "fish0 DLC_resnet50_heartSynthetic.csv", frames, seed=seed, **kwargs)
+        trace_path = convert_to_trace(csv_path)
+
+        PARAMS = dict(DEFAULT_VALUES)
+        reference = Analyzer(csv_path, PARAMS, cache=False)
+        reference.df_Loader(get_tolerance=True)
+        PARAMS["TOLERANCE"] = float(reference.tolerance)
+        reference.Peak_Finder()
+
+        for name, overrides in filter_settings(reference.maxima, reference.minima):
+            expected = analyze(csv_path, {**PARAMS, **overrides})
+            result = analyze(trace_path, {**PARAMS, **overrides})
+            same = np.array_equal(expected.maxima.x, result.maxima.x) and np.array_equal(expected.minima.x, result.minima.x) \
+                   and all(np.isclose(expected.ENDPOINTS[key], result.ENDPOINTS[key], equal_nan=True) for key in expected.ENDPOINTS)
+            print(f"{'ok  ' if same else 'FAIL'} {name}: {len(expected.maxima)}/{len(expected.minima)} maxima/minima in the csv, "
+                  f"{len(result.maxima)}/{len(result.minima)} in the trace")
+            if not same:
+                failed.append(name)
+
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that traces and csv files give the same peaks and endpoints")
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--window", type=int, default=997, help="frames per window of the trace analysis")
+    parser.add_argument("--dropouts", type=float, default=5, help="tracking losses per 1000 frames and bodypart of the second recording")
+    args = parser.parse_args()
+
+    # Analyzer windows the trace with the default window of Libs.trace.windows
+    Libs.trace.windows.__defaults__ = (args.window,)
+
+    failed = []
+    for dropouts in (0, args.dropouts):
+        print(f"{dropouts} tracking losses per 1000 frames:")
+        failed += check(args.frames, dropouts=dropouts)
+
+    sys.exit(1 if failed else 0)
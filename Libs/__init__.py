@@ -5,13 +5,54 @@ DEFAULT_VALUES = {
     "TOLERANCE": 0.1,
 }
 EXCLUDE_FRAMES_FROM_EDGE = 10
+XLSX_CHUNK_ROWS = 65536 # rows streamed from a workbook before they are stacked into one array
+TRACE_SUFFIX = ".trace" # memory-mapped binary traces, see Libs/trace.py
+TRACE_CHUNK_ROWS = 262144 # csv rows converted at a time
+TRACE_WINDOW_FRAMES = 1048576 # frames processed at a time when analyzing a trace
+HEART_BODYPARTS = ["heart1", "heart3", "heart5", "heart7"] # long axis heart1-heart5, short axis heart3-heart7
+LIKELIHOOD_THRESHOLD = 0.6 # points tracked with a lower DeepLabCut likelihood are masked, 0 disables
+INTERPOLATE_MAX_GAP = 10 # masked runs of at most this many frames are linearly interpolated
+INDIVIDUAL_SEPARATOR = "/" # columns of multi-animal files are named f"{individual}/{bodypart}_{coord}"
+PEAK_FINDER_BACKEND = "fast" # "python" for the reference implementation
+TOLERANCE_SWEEP = (0.05, 2.0, 40) # tolerances tried by Find Tolerance: (first, last, count) fractions of the volume std
+ENDPOINT_WINDOW = (10, 5) # seconds (window, step) of the endpoint time series, equal values give tumbling windows
+HRV_RESAMPLE_HZ = 4 # the NN tachogram is resampled at this rate for its Welch spectrum
+HRV_WELCH_SECONDS = 30 # length of the Welch windows, shorter recordings get no LF/HF
+HRV_BANDS = {"LF": (0.04, 0.15), "HF": (0.15, 0.4)} # Hz, the usual human bands, to adapt to the heart rate of the species
+LIVE_WINDOW_BEATS = 20 # beats used for the rolling endpoints of a recording that is still being written
+LIVE_READ_SIZE = 1024**2 # characters read at a time from a file that is being followed, so memory does not grow with the file
+BATCH_WORKERS = None # number of processes for multi-file analysis, None uses every core
+SKIP_UNCHANGED = True # a batch keeps the stored endpoints of files unchanged since they were analyzed with the same parameters
+CHECKPOINT_FILES = 32 # finished files written to the endpoint store at a time, all that a crashed batch loses
+LOG_FILE = "Log/app.log"
+LOG_LEVEL = "INFO" # "DEBUG" also logs parameters, file lists and columns of every file
+LOG_MAX_BYTES = 10 * 1024**2 # the log file is rotated above this size
+LOG_BACKUP_COUNT = 5 # rotated log files kept
+GUI_POLL_MS = 100 # how often the window checks the background analysis for progress
+PROFILING_ENABLED = False # per-stage timing and memory of Analyzer, see Libs/profiling.py
 
 ENTRY_NAMES_SET1 = ['CONVERSION RATE', 'FRAME RATE']
-ENTRY_NAMES_SET2 = ['TOLERANCE', 'minPeakDistance', 'minMaximaValue', 'maxMaximaValue']
+ENTRY_NAMES_SET2 = ['TOLERANCE', 'minPeakDistance', 'minMaximaValue', 'maxMaximaValue', 'minPeakProminence']
+PEAK_FILTER_NAMES = ENTRY_NAMES_SET2[1:] # optional, an empty entry (None) disables the filter
 ENTRY_NAMES = ENTRY_NAMES_SET1 + ENTRY_NAMES_SET2
 
 MUST_FILL = ['CONVERSION RATE', 'FRAME RATE', 'TOLERANCE']
 
 OUTPUT_DIR = "Output"
 SUMMARY_PATH = "Output/SDSummary.xlsx"
-PEAKS_IMG_PATH = "Output/Peaks"
\ No newline at end of file
+STORE_PATH = "Output/endpoints.sqlite"
+ENDPOINT_SERIES_PATH = "Output/EndpointSeries" # one csv per file, see Analyzer.EndPoints_Series
+SAVE_FRAMES = True # save the per-frame traces and peak tables of every analyzed file, see Libs/frames.py
+FRAMES_PATH = "Output/Frames"
+FRAMES_FORMAT = "parquet" # "feather" also needs pyarrow, without it compressed "npz" files are written instead
+FRAMES_CHUNK_ROWS = 65536 # frames per Parquet row group or Feather record batch
+
+PARSED_CACHE_ENABLED = True
+CACHE_DIR = "Output/.cache"
+CACHE_MAX_BYTES = 2 * 1024**3 # least recently used parsed inputs are evicted above this size
+PEAKS_IMG_PATH = "Output/Peaks"
+PLOT_RENDERER = "fast" # "fast" saves decimated plots with Agg (Libs/render.py), "figure" saves every frame as before
+PLOT_DPI = 150
+PLOT_FORMAT = "png" # any format matplotlib saves: "png", "svg", "pdf", ...
+PLOT_SIZE = (20, 10) # inches
+PLOT_WORKERS = 2 # processes rendering the plots of a batch, 0 renders in the main process
\ No newline at end of file
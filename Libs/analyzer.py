@@ -1,32 +1,80 @@
+import copy
 import numpy as np
+import os
+import shutil
+import tempfile
+import weakref
 
 from Libs.reader import *
-from Libs.calculations import PeakFinder, SDCalculator
-from Libs.utils import make_df, draw_peaks
-from . import ALLOWED_DECIMALS, SUMMARY_PATH, EXCLUDE_FRAMES_FROM_EDGE
+from Libs.reader import stack_individuals, is_likelihood
+from Libs.calculations import PeakFinder, PeakFilter, SDCalculator, GeometryCalculator, ToleranceSweeper, suggest_tolerance, WindowedEndpoints
+from Libs.calculations import HRVCalculator, pack_intervals, hrv_endpoints, LikelihoodFilter, rank_peaks
+from Libs.utils import draw_peaks
+from Libs.results import PeakTable, AnalysisResult
+from Libs.store import EndpointStore
+from Libs.cache import get_parsed_cache
+from Libs.live import IncrementalExtremaFinder, IncrementalLikelihoodFilter
+from Libs.trace import open_trace, windows, windowed_std
+from Libs.profiling import get_profiler, profiled
+from Libs.frames import save_frames
+from . import ALLOWED_DECIMALS, EXCLUDE_FRAMES_FROM_EDGE, PARSED_CACHE_ENABLED, HEART_BODYPARTS, TRACE_SUFFIX, PEAK_FILTER_NAMES
+from . import ENDPOINT_WINDOW, ENDPOINT_SERIES_PATH, LIKELIHOOD_THRESHOLD, INTERPOLATE_MAX_GAP, FRAMES_PATH
 
 class Analyzer:
 
-    def __init__(self, given_path, PARAMS):
+    def __init__(self, given_path, PARAMS, cache=None, profiler=None):
+        """
+        cache is a ParsedCache, None uses the cache shared by the process, False disables caching
+        profiler is a Profiler, None uses the profiler shared by the process (see PROFILING_ENABLED)
+        Multi-animal files are loaded for every individual at once, see Individuals
+        """
 
         self.given_path = given_path
         self.PARAMS = PARAMS
+        self.profiler = profiler if profiler is not None else get_profiler()
 
         self.DEFAULT_GET_TOLERANCE_MODE = False
 
         reader = Reader(given_paths = [given_path])
 
-        dfs_dict = reader.get_dfs_dict()
-        for core_name, df in dfs_dict.items():
-            dfs_dict[core_name] = self.cleaner(df)
-            
         try:
-            self.core_name = list(dfs_dict.keys())[0]
+            self.core_name, file_path = list(reader.file_paths_dict.items())[0]
         except IndexError:
-            logger.debug(f"dfs_dict: {dfs_dict}")
+            logger.debug("file_paths_dict: %s", reader.file_paths_dict)
             logger.error(f"No file found in {given_path}")
             raise IndexError(f"No file found in {given_path}")
-        self.cleaned_df = list(dfs_dict.values())[0]
+
+        if cache is None and PARSED_CACHE_ENABLED:
+            cache = get_parsed_cache()
+
+        # Trace files are memory-mapped and processed in windows, see Libs/trace.py
+        self.windowed = Path(file_path).suffix == TRACE_SUFFIX
+
+        # Cleaned heart1/3/5/7 coordinates, one float array per column
+        if self.windowed:
+            self.coords = open_trace(file_path)
+            self.cache_hit = None
+        else:
+            with self.profiler.stage("cache_load", given_path):
+                self.coords = cache.load(file_path) if cache else None
+            self.cache_hit = self.coords is not None
+
+        if self.coords is None:
+            with self.profiler.stage("DataCleaner", given_path):
+                self.coords = self.cleaner(reader.DataCleaner(file_path, bodyparts=HEART_BODYPARTS, likelihood=True))
+            if cache:
+                with self.profiler.stage("cache_save", given_path):
+                    cache.save(file_path, self.coords)
+
+        # (frames x individuals) arrays for a multi-animal file
+        self.coords, self.individuals = stack_individuals(self.coords)
+        self.individual = None
+        if self.individuals is not None:
+            if self.windowed:
+                raise ValueError(f"{given_path} is a multi-animal trace, analyze the csv/xlsx file it was converted from")
+            if not self.individuals:
+                raise ValueError(f"No individual of {given_path} has every one of {HEART_BODYPARTS}")
+            logger.info(f"{len(self.individuals)} individuals in {given_path}: {self.individuals}")
 
         try:
             self.tolerance = PARAMS["TOLERANCE"]
@@ -36,97 +84,196 @@ class Analyzer:
             logger.info("Tolerance not found in PARAMS, probably the first time running, setting df_loader's default get_tolerance to True")
             self.DEFAULT_GET_TOLERANCE_MODE = True
 
-        logger.debug(f"PARAMS: {PARAMS}")
+        logger.debug("PARAMS: %s", PARAMS)
 
         self.ENDPOINTS = {}
     
-    def cleaner(self, given_df):
-
-        excepted_columns = []
+    @staticmethod
+    def cleaner(given_df):
+        """
+        {column: array} of the heart bodyparts, taken from the data frame without copying it:
+        x/y as float64, likelihood as float32
+        """
+
+        coords = {}
         for column in given_df.columns:
-            if any([f"heart{num}" in column.lower() for num in [1, 3, 5, 7]]):
-                excepted_columns.append(column)
+            if any([bodypart in column.lower() for bodypart in HEART_BODYPARTS]):
+                coords[column] = given_df[column].to_numpy(dtype=np.float32 if is_likelihood(column) else float)
 
-        cleaned_df = given_df[excepted_columns]
-
-        # change all values in cleaned_df to float
-        cleaned_df = cleaned_df.astype(float)
-
-        return cleaned_df
+        return coords
     
 
+    @profiled("df_Loader")
     def df_Loader(self, get_tolerance=None):
 
         if get_tolerance is None:
             get_tolerance = self.DEFAULT_GET_TOLERANCE_MODE
 
-        cleaned_df = self.cleaned_df
-
-        self.FRAMES = len(cleaned_df)
-
-        LAD_in_pixel = []
-        LAD_in_mm = []
-
-        SAD_in_pixel = []
-        SAD_in_mm = []
-
-        Heart_Volumes_in_mm3 = []
-        Heart_Volumes_in_pL = []
-
-        for i in range(self.FRAMES):
-            h5x = cleaned_df.iloc[i]["heart5_x"]
-            h5y = cleaned_df.iloc[i]["heart5_y"]
-            h1x = cleaned_df.iloc[i]["heart1_x"]
-            h1y = cleaned_df.iloc[i]["heart1_y"]
-            long_axis_distance_pixel = np.sqrt((h5x - h1x)**2 + (h5y - h1y)**2)
-            long_axis_distance_mm = long_axis_distance_pixel / self.PARAMS["CONVERSION RATE"]
-            LAD_in_pixel.append(long_axis_distance_pixel)
-            LAD_in_mm.append(long_axis_distance_mm)
-
-            h7x = cleaned_df.iloc[i]["heart7_x"]
-            h7y = cleaned_df.iloc[i]["heart7_y"]
-            h3x = cleaned_df.iloc[i]["heart3_x"]
-            h3y = cleaned_df.iloc[i]["heart3_y"]
-            short_axis_distance_pixel = np.sqrt((h7x - h3x)**2 + (h7y - h3y)**2)
-            short_axis_distance_mm = short_axis_distance_pixel / self.PARAMS["CONVERSION RATE"]
-            SAD_in_pixel.append(short_axis_distance_pixel)
-            SAD_in_mm.append(short_axis_distance_mm)
-
-            Heart_Volume = 1/6 * np.pi * long_axis_distance_mm * short_axis_distance_mm**2
-            Heart_Volumes_in_mm3.append(Heart_Volume)
-            Heart_Volumes_in_pL.append(Heart_Volume * 10**6)
-
-        # summary_df = pd.DataFrame()
-        # summary_df["LAD_in_pixel"] = LAD_in_pixel
-        # summary_df["LAD_in_mm"] = LAD_in_mm
-        # summary_df["SAD_in_pixel"] = SAD_in_pixel
-        # summary_df["SAD_in_mm"] = SAD_in_mm
-        # summary_df["Heart_Volumes_in_mm3"] = Heart_Volumes_in_mm3
-        # summary_df["Heart_Volumes_in_pL"] = Heart_Volumes_in_pL
+        self.FRAMES = len(next(iter(self.coords.values())))
+
+        threshold = self.PARAMS.get("LIKELIHOOD THRESHOLD", LIKELIHOOD_THRESHOLD)
+        max_gap = self.PARAMS.get("INTERPOLATE MAX GAP", INTERPOLATE_MAX_GAP)
+
+        if self.windowed:
+            if threshold is not None and threshold > 0 and not any(is_likelihood(column) for column in self.coords):
+                logger.warning(f"{self.given_path} has no likelihood columns, low likelihood points are not filtered: "
+                               f"convert the file it comes from to a trace again")
+            self.geometry = self.windowed_geometry(threshold, max_gap)
+        else:
+            with self.profiler.stage("LikelihoodFilter", self.given_path):
+                coords, masked, interpolated = LikelihoodFilter(self.coords, threshold, max_gap)
+            if masked:
+                logger.info(f"{masked} low likelihood points masked, {interpolated} interpolated in {self.given_path}")
+            self.geometry = GeometryCalculator(coords, self.PARAMS["CONVERSION RATE"])
+
+        Heart_Volumes_in_pL = self.geometry["Heart_Volumes_in_pL"]
 
         self.get_Heart_Volume_in_pL = Heart_Volumes_in_pL
         if get_tolerance:
-            self.tolerance = np.std(Heart_Volumes_in_pL)
+            # One tolerance per individual for a multi-animal file
+            self.tolerance = windowed_std(Heart_Volumes_in_pL) if self.windowed else np.std(Heart_Volumes_in_pL, axis=0)
             logger.info(f"After calculation, overwrite given tolerance with {self.tolerance}")
 
         
-        self.short_axis = LAD_in_mm
+        self.short_axis = self.geometry["LAD_in_mm"]
+
+
+
+    def Individuals(self):
+        """
+        One Analyzer per individual of a multi-animal file, run after df_Loader: they share the geometry and tolerance
+        computed for every individual at once, and go on (Peak_Finder, EndPoints_Calculator...) as single-animal files
+        Returns [self] for a single-animal file
+        """
+
+        if self.individuals is None:
+            return [self]
+
+        analyzers = []
+        for index, individual in enumerate(self.individuals):
+            analyzer = copy.copy(self)
+            analyzer.individual = individual
+            analyzer.core_name = f"{self.core_name}_{individual}"
+            analyzer.geometry = {key: np.ascontiguousarray(values[:, index]) for key, values in self.geometry.items()}
+            analyzer.get_Heart_Volume_in_pL = analyzer.geometry["Heart_Volumes_in_pL"]
+            analyzer.short_axis = analyzer.geometry["LAD_in_mm"]
+            analyzer.tolerance = self.tolerance[index] if np.ndim(self.tolerance) else self.tolerance
+            analyzer.ENDPOINTS = {}
+            analyzers.append(analyzer)
+
+        return analyzers
+
+
+    def windowed_geometry(self, threshold=LIKELIHOOD_THRESHOLD, max_gap=INTERPOLATE_MAX_GAP):
+        """
+        LikelihoodFilter and GeometryCalculator over the memory-mapped trace, one window at a time
+        IncrementalLikelihoodFilter carries the masked runs across windows, so the frames are cleaned as in one piece
+        The per-frame results go to memory-mapped files in a temporary directory, removed with the Analyzer
+        """
+
+        temp_dir = tempfile.mkdtemp(prefix="cpad-")
+        weakref.finalize(self, shutil.rmtree, temp_dir, ignore_errors=True)
+
+        likelihood_filter = IncrementalLikelihoodFilter(threshold, max_gap)
+        geometry = {}
+        written = 0
+
+        def write(coords):
+            nonlocal written
+            if not coords or not len(next(iter(coords.values()))):
+                return
+            window_geometry = GeometryCalculator(coords, self.PARAMS["CONVERSION RATE"])
+            for key, values in window_geometry.items():
+                if key not in geometry:
+                    geometry[key] = np.lib.format.open_memmap(os.path.join(temp_dir, f"{key}.npy"), mode="w+",
+                                                              dtype=np.float64, shape=(self.FRAMES,))
+                geometry[key][written:written + len(values)] = values
+            written += len(values)
+
+        masked = 0
+        for start, stop in windows(self.FRAMES):
+            # The likelihood is float32 when read from the csv/xlsx file, the trace keeps those values as float64
+            coords = {column: values[start:stop].astype(np.float32) if is_likelihood(column) else values[start:stop]
+                      for column, values in self.coords.items()}
+            if threshold is not None and threshold > 0:
+                masked += sum(int(np.count_nonzero(values < threshold)) for column, values in coords.items() if is_likelihood(column))
+            write(likelihood_filter.feed(coords))
+        write(likelihood_filter.finish())
+
+        if masked:
+            logger.info(f"{masked} low likelihood points masked in {self.given_path}")
+
+        return geometry
+
+
+    def windowed_peak_finder(self):
+        """
+        Same peaks as PeakFinder, found one window at a time with the incremental state machine
+        Ranked by value like PeakFinder's (see rank_peaks), for PeakFilter
+        """
+
+        yvalues = self.get_Heart_Volume_in_pL
+        maxima_finder = IncrementalExtremaFinder(self.tolerance, sign=1)
+        minima_finder = IncrementalExtremaFinder(self.tolerance, sign=-1)
+
+        maxima = []
+        minima = []
+        for start, stop in windows(self.FRAMES):
+            maxima += maxima_finder.feed(yvalues[start:stop])
+            minima += minima_finder.feed(yvalues[start:stop])
+        maxima += maxima_finder.finish()
+        minima += minima_finder.finish()
+
+        maxima = rank_peaks([position for position, _ in maxima], yvalues, sign=1)
+        minima = rank_peaks([position for position, _ in minima], yvalues, sign=-1)
+
+        return range(self.FRAMES), yvalues, maxima, minima
+
+
+    @profiled("Tolerance_Sweeper")
+    def Tolerance_Sweeper(self, tolerances=None):
+        """
+        Peak count, heart rate and beat interval regularity for many tolerances in one pass, see ToleranceSweeper
+        Run after df_Loader. Sets self.tolerance to the suggested (most stable) tolerance when there is one
+        """
+
+        self.tolerance_sweep = ToleranceSweeper(self.get_Heart_Volume_in_pL, self.PARAMS["FRAME RATE"], tolerances)
+
+        suggested = suggest_tolerance(self.tolerance_sweep)
+        if suggested is None:
+            logger.warning(f"No swept tolerance finds enough peaks in {self.given_path}, keeping tolerance {self.tolerance}")
+        else:
+            self.tolerance = suggested
+            logger.info(f"Tolerance sweep suggests {self.tolerance}")
 
+        return self.tolerance_sweep
 
 
+    @profiled("Peak_Finder")
     def Peak_Finder(self):
 
-        xvalues, yvalues, maxima, minima = PeakFinder(progress_bar=None,
-                                                    yvalues = self.get_Heart_Volume_in_pL, 
-                                                    tolerance = self.tolerance)
+        if self.individuals is not None and self.individual is None:
+            raise ValueError(f"{self.given_path} is a multi-animal file, find the peaks of each of Individuals()")
+
+        # minPeakDistance, minMaximaValue, maxMaximaValue and minPeakProminence, when given
+        peak_filters = {name: self.PARAMS[name] for name in PEAK_FILTER_NAMES if self.PARAMS.get(name) is not None}
+
+        if self.windowed:
+            xvalues, yvalues, maxima, minima = self.windowed_peak_finder()
+            maxima, minima = PeakFilter(yvalues, maxima, minima, **peak_filters)
+        else:
+            xvalues, yvalues, maxima, minima = PeakFinder(progress_bar=None,
+                                                        yvalues = self.get_Heart_Volume_in_pL, 
+                                                        tolerance = self.tolerance,
+                                                        **peak_filters)
         
         logger.info("Peak_Finder finished")
         
-        self.df_maxima, self.df_minima = make_df(xvalues, yvalues, maxima, minima)
-        logger.info("df_maxima and df_minima created")
+        self.maxima = PeakTable.from_peaks(xvalues, yvalues, maxima)
+        self.minima = PeakTable.from_peaks(xvalues, yvalues, minima)
 
         self.finder_df_edge_excluder()
-        logger.info("df_maxima and df_minima edge excluded")
+        logger.info("Peak tables created and edge excluded")
 
         self.values_for_draw = [xvalues, yvalues, maxima, minima]
 
@@ -138,59 +285,51 @@ class Analyzer:
 
     def finder_df_edge_excluder(self, exclude = EXCLUDE_FRAMES_FROM_EDGE):
 
-        frame_threshold_lower = exclude
-        frame_threshold_upper = self.FRAMES - exclude
-
-        # Remove rows from self.df_maxima and self.df_minima that are in the first and last 10 frames
-        self.df_maxima = self.df_maxima[(self.df_maxima['X_maxima'] >= frame_threshold_lower) & (self.df_maxima['X_maxima'] <= frame_threshold_upper)]
-        self.df_minima = self.df_minima[(self.df_minima['X_minima'] >= frame_threshold_lower) & (self.df_minima['X_minima'] <= frame_threshold_upper)]
+        # Remove the peaks in the first and last `exclude` frames
+        self.maxima = self.maxima.between(exclude, self.FRAMES - exclude)
+        self.minima = self.minima.between(exclude, self.FRAMES - exclude)
 
 
-    def EndPoints_Calculator(self, based_on="maxima"):
+    @property
+    def df_maxima(self):
+        return self.maxima.to_df("maxima")
 
-        assert based_on in ["maxima", "minima"], "based_on must be either 'maxima' or 'minima'"
+    @property
+    def df_minima(self):
+        return self.minima.to_df("minima")
 
-        # calculate intervals_maxima based on diff of df_maxima['X_maxima'] then convert to second by dividing to FRAMERATE
-        intervals_maxima = self.df_maxima['X_maxima'].diff() / self.PARAMS["FRAME RATE"]
-        intervals_maxima = intervals_maxima[1:] # remove first row because it is NaN
 
-        # calculate intervals_minima based on diff of df_minima['X_minima'] then convert to second by dividing to FRAMERATE
-        intervals_minima = self.df_minima['X_minima'].diff() / self.PARAMS["FRAME RATE"]
-        intervals_minima = intervals_minima[1:] # remove first row because it is NaN
+    @profiled("EndPoints_Calculator")
+    def EndPoints_Calculator(self, based_on="maxima", hrv=True):
+        """
+        hrv=False leaves out the HRVCalculator metrics, for run_batch which computes those of every file at once from self.nn_array
+        """
 
+        assert based_on in ["maxima", "minima"], "based_on must be either 'maxima' or 'minima'"
 
-        if based_on == "maxima":
-            nn_array = np.array(intervals_maxima)
-        elif based_on == "minima":
-            nn_array = np.array(intervals_minima)
+        # intervals between consecutive peaks, in seconds
+        beats = self.maxima if based_on == "maxima" else self.minima
+        nn_array = np.diff(beats.x) / self.PARAMS["FRAME RATE"]
 
 
         # Calculate EDV and ESV
-        self.ENDPOINTS["Average EDV"] = self.df_maxima["Y_maxima"].mean()
-        self.ENDPOINTS["Average ESV"] = self.df_minima["Y_minima"].mean()
+        self.ENDPOINTS["Average EDV"] = np.mean(self.maxima.y)
+        self.ENDPOINTS["Average ESV"] = np.mean(self.minima.y)
 
 
         # Calculate Stroke Volume and related Endpoints
-        first_max_FRAME = self.df_maxima["X_maxima"].values[0]
-        first_min_FRAME = self.df_minima["X_minima"].values[0]
+        y_maxima = self.maxima.y
+        y_minima = self.minima.y
 
-        y_maxima_list = self.df_maxima["Y_maxima"].values.tolist()
-        y_minima_list = self.df_minima["Y_minima"].values.tolist()
-
-        if first_max_FRAME > first_min_FRAME: # the ECG starts with a low peak
-            y_minima_list = y_minima_list[1:]
+        if self.maxima.x[0] > self.minima.x[0]: # the ECG starts with a low peak
+            y_minima = y_minima[1:]
             logger.info("the ECG starts with a low peak")
         else: # the ECG starts with a high peak
             logger.info("the ECG starts with a high peak")
 
-        stroke_num = min(len(y_maxima_list), len(y_minima_list))
-
-        stroke_list = []
-
-        for num in range(stroke_num):
-            stroke_list.append(y_maxima_list[num] - y_minima_list[num])
+        stroke_num = min(len(y_maxima), len(y_minima))
 
-        self.ENDPOINTS["Stroke volume (pL/beat)"] = np.mean(stroke_list)
+        self.ENDPOINTS["Stroke volume (pL/beat)"] = np.mean(y_maxima[:stroke_num] - y_minima[:stroke_num])
         
         self.ENDPOINTS['Heart rate (BPM)'] = round(60 / np.mean(nn_array), ALLOWED_DECIMALS)
         self.ENDPOINTS['Cardiac Output (pL/beat)'] = round(self.ENDPOINTS['Stroke volume (pL/beat)'] * self.ENDPOINTS['Heart rate (BPM)'], ALLOWED_DECIMALS)
@@ -198,8 +337,8 @@ class Analyzer:
 
 
         # Calculate Shortening Fraction
-        ShortAxisMaxima = [self.short_axis[i] for i in self.df_maxima["X_maxima"].values.tolist()]
-        ShortAxisMinima = [self.short_axis[i] for i in self.df_minima["X_minima"].values.tolist()]
+        ShortAxisMaxima = self.short_axis[self.maxima.x]
+        ShortAxisMinima = self.short_axis[self.minima.x]
 
         self.ENDPOINTS["Shortening Fraction (%)"] = (np.mean(ShortAxisMaxima) - np.mean(ShortAxisMinima)) / np.mean(ShortAxisMaxima) * 100
 
@@ -211,35 +350,65 @@ class Analyzer:
         self.ENDPOINTS["SD1"] = round(sd1, ALLOWED_DECIMALS)
         self.ENDPOINTS["SD2"] = round(sd2, ALLOWED_DECIMALS)
 
+        self.nn_array = nn_array
+        if hrv:
+            self.ENDPOINTS.update(hrv_endpoints(HRVCalculator(*pack_intervals([nn_array])), 0))
 
 
-    def EndPoints_Updater(self):
+    def Result(self):
+        """
+        AnalysisResult of this recording (or individual), after EndPoints_Calculator: arrays only, no DataFrame
+        """
 
-        summary_path = Path(SUMMARY_PATH)
+        return AnalysisResult(self.given_path, self.individual, self.get_Heart_Volume_in_pL, self.short_axis,
+                              self.maxima, self.minima, self.ENDPOINTS)
 
-        if summary_path.exists():
-            summary_df = pd.read_excel(summary_path)
-            if self.given_path in summary_df["File Path"].values:
-                # If the path exists, update the SD1 and SD2 values
-                summary_df.loc[summary_df["File Path"] == self.given_path, list(self.ENDPOINTS.keys())] = list(self.ENDPOINTS.values())
-                logger.info(f"Updated Endpoints for {self.given_path}")
-            else:
-                # If the path doesn't exist, append a new row with the SD1 and SD2 values
-                new_row = pd.DataFrame(data=[list(self.ENDPOINTS.values())], columns=list(self.ENDPOINTS.keys()))
-                new_row.insert(0, "File Path", self.given_path)
-                summary_df = pd.concat([summary_df, new_row], ignore_index=True)
-                logger.info(f"Added Endpoints for {self.given_path}")
-        else:
-            # Make a dataframe from self.ENDPOINTS
-            summary_df = pd.DataFrame(data=[list(self.ENDPOINTS.values())], columns=list(self.ENDPOINTS.keys()))
-            # Add column 0 with the file path
-            summary_df.insert(0, "File Path", self.given_path)
-            logger.info(f"Created a new summary file for {self.given_path}")
 
-        # Save the dataframe to the summary file
-        summary_df.to_excel(summary_path, index=False)
-        logger.info(f"Updated summary file at {summary_path}")
+    @profiled("EndPoints_Series")
+    def EndPoints_Series(self, window_s=ENDPOINT_WINDOW[0], step_s=ENDPOINT_WINDOW[1], based_on="maxima"):
+        """
+        The endpoints of EndPoints_Calculator over windows of window_s seconds every step_s seconds,
+        from the same peaks, for recordings whose endpoints change over time. See calculations.WindowedEndpoints
+        """
+
+        self.endpoint_series = WindowedEndpoints(self.maxima.x, self.maxima.y, self.minima.x, self.minima.y,
+                                                 self.short_axis, self.PARAMS["FRAME RATE"], self.FRAMES,
+                                                 window_s, step_s, based_on)
+        logger.info(f"Endpoints of {len(self.endpoint_series['Beats'])} windows of {window_s} s calculated")
+
+        return self.endpoint_series
+
+
+    def Save_EndPoints_Series(self, output_dir=ENDPOINT_SERIES_PATH):
+
+        import pandas as pd
+
+        output_path = Path(output_dir) / f"{self.core_name}.csv"
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame(self.endpoint_series).to_csv(output_path, index=False)
+        logger.info(f"Saved endpoint series to {output_path}")
+
+        return str(output_path)
+
+
+    @profiled("Save_Frames")
+    def Save_Frames(self, output_dir=FRAMES_PATH):
+        """
+        Save the per-frame geometry and the peak tables in one compressed columnar file, after Peak_Finder,
+        so that they can be inspected without analyzing the input again. See frames.save_frames and frames.load_frames
+        """
+
+        return save_frames(self.core_name, self.geometry, self.maxima, self.minima, output_dir)
+
+
+    @profiled("EndPoints_Updater")
+    def EndPoints_Updater(self, materialize=True):
+
+        store = EndpointStore()
+        store.upsert(self.given_path, self.ENDPOINTS, self.individual)
 
+        if materialize:
+            store.materialize()
 
 
 
@@ -267,6 +436,7 @@ class Analyzer:
     #     logger.info(f"Summary file updated: {summary_path}")
 
 
+    @profiled("SavePeaks")
     def SavePeaks(self):
 
         try:
@@ -280,4 +450,4 @@ class Analyzer:
             logger.error("Error saving peaks")
             raise e            
         
-        logger.info("Peaks saved")
\ No newline at end of file
+        logger.info("Peaks saved")
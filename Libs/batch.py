@@ -0,0 +1,253 @@
+import concurrent.futures
+import os
+
+import logging
+
+from Libs.analyzer import Analyzer
+from Libs.store import EndpointStore
+from Libs.profiling import Profiler
+from Libs.render import RenderPool, plot_data
+from Libs.logsetup import worker_logging
+from Libs.calculations import HRVCalculator, pack_intervals, hrv_endpoints
+from Libs.cache import file_state
+from Libs.manifest import check_unchanged, manifest_entry, options_key
+from . import BATCH_WORKERS, PLOT_RENDERER, PLOT_WORKERS, SKIP_UNCHANGED, CHECKPOINT_FILES, SAVE_FRAMES
+
+logger = logging.getLogger(__name__)
+
+CANCELLED = "Cancelled"
+CANCEL_POLL_SECONDS = 0.2
+
+
+def new_result(given_path, individual=None, error=None):
+    return {"File Path": given_path, "Individual": individual, "ENDPOINTS": None, "error": error,
+            "cache_hit": None, "profile": None, "plot": None, "series": None, "frames": None, "nn": None,
+            "source": None, "unchanged": False}
+
+
+def failed_result(given_path, error):
+    return new_result(given_path, error=error)
+
+
+def result_name(result):
+    if result["Individual"] is None:
+        return result["File Path"]
+    return f"{result['File Path']} ({result['Individual']})"
+
+
+def analyze_file(given_path, PARAMS, save_peaks=True, profile=False, endpoint_window=None, save_frames=SAVE_FRAMES):
+    """
+    Full analysis of one file, as run by the batch workers
+    Returns a list of results: one per individual of a multi-animal file (in its "Individual" field), a single one otherwise
+    Never raises: a failure is reported in the "error" field so that it only affects this file, or individual
+    With profile, the Profiler records of the file are returned in the "profile" field of the first result
+    With the fast renderer, the plot is not drawn here: its decimated data is returned in the "plot" field
+    The HRV endpoints are left to run_batch, the NN intervals are returned in the "nn" field
+    With endpoint_window (window, step) in seconds, the endpoint time series is saved and its path returned in the "series" field
+    With save_frames, the per-frame traces and peak tables are saved and their path returned in the "frames" field
+    The (size, mtime in ns, sha256) of the file before it was read are returned in the "source" field, for the run manifest
+    """
+
+    results = []
+    profiler = Profiler(enabled=profile)
+
+    try:
+        source = file_state(given_path)
+        analyzer = Analyzer(given_path, PARAMS, profiler=profiler)
+        # Geometry and tolerance of every individual at once
+        analyzer.df_Loader()
+        for individual in analyzer.Individuals():
+            result = new_result(given_path, individual.individual)
+            result["cache_hit"] = analyzer.cache_hit
+            result["source"] = source
+            results.append(result)
+            try:
+                individual.Peak_Finder()
+                individual.EndPoints_Calculator(hrv=False)
+                result["nn"] = individual.nn_array
+                if endpoint_window is not None:
+                    individual.EndPoints_Series(*endpoint_window)
+                    result["series"] = individual.Save_EndPoints_Series()
+                if save_frames:
+                    result["frames"] = individual.Save_Frames()
+                if save_peaks and PLOT_RENDERER == "fast":
+                    with profiler.stage("plot_data", given_path):
+                        result["plot"] = (individual.core_name, plot_data(individual.values_for_draw))
+                elif save_peaks:
+                    individual.SavePeaks()
+                result["ENDPOINTS"] = individual.ENDPOINTS
+            except Exception as e:
+                logger.exception(f"Analysis of {result_name(result)} failed")
+                result["error"] = f"{type(e).__name__}: {e}"
+    except Exception as e:
+        logger.exception(f"Analysis of {given_path} failed")
+        results = [failed_result(given_path, f"{type(e).__name__}: {e}")]
+    finally:
+        profiler.close()
+
+    if profile:
+        results[0]["profile"] = profiler.records
+
+    return results
+
+
+def run_batch(file_params, max_workers=BATCH_WORKERS, on_result=None, save_peaks=True, profiler=None, cancel_event=None,
+              endpoint_window=None, skip_unchanged=SKIP_UNCHANGED, save_frames=SAVE_FRAMES):
+    """
+    file_params is a list of (file path, PARAMS)
+    Files are analyzed in a pool of max_workers processes (None uses every core, 1 runs in this process)
+    on_result(index, result) is called in this process for every result (individual) of file_params[index],
+    as soon as the file is done, in completion order
+    Plots are rendered by a RenderPool while the other files are analyzed
+    Only this process writes the endpoint store, every CHECKPOINT_FILES finished files, and the summary file, once at the end,
+    with the new files in the order of file_params
+    With skip_unchanged, files whose content, PARAMS, options and code are those recorded in the manifest of the store
+    are not analyzed again: their stored endpoints are returned with "unchanged" True. As finished files are recorded
+    as they are written, running a crashed or cancelled batch again only analyzes the files it had not written yet
+    With an enabled profiler, the stages of every worker are merged into it
+    Setting cancel_event (a threading.Event) stops the batch: files not started yet get the error CANCELLED,
+    files being analyzed finish, and every finished file is still written to the summary
+    endpoint_window (window, step) in seconds also saves the endpoint time series of every file, and save_frames
+    its per-frame traces and peak tables, see analyze_file
+    Returns the list of results in the order of file_params, with one result per individual of multi-animal files
+    """
+
+    results = [None] * len(file_params) # list of results of each file
+    profiler = profiler if profiler is not None else Profiler(enabled=False)
+    profile = profiler.enabled
+
+    store = EndpointStore()
+    store.reserve([given_path for given_path, _ in file_params])
+    options = options_key(save_peaks, endpoint_window, save_frames)
+    unwritten = [] # indices of the finished files not written to the store yet
+
+    def checkpoint():
+        """
+        HRV metrics of the unwritten files in one vectorized call, then their endpoints and manifest entries in one transaction
+        A file is only recorded in the manifest if all its results succeeded, so that failed files are analyzed again
+        """
+
+        unwritten.sort() # in the order of file_params, whatever the order the workers finished in
+        analyzed = [result for index in unwritten for result in results[index] if result["error"] is None]
+        with profiler.stage("HRVCalculator"):
+            metrics = HRVCalculator(*pack_intervals([result["nn"] for result in analyzed]))
+            for position, result in enumerate(analyzed):
+                result["ENDPOINTS"].update(hrv_endpoints(metrics, position))
+
+        manifest = [manifest_entry(file_params[index][0], results[index][0]["source"], file_params[index][1], options)
+                    for index in unwritten if all(result["error"] is None for result in results[index])]
+        with profiler.stage("store"):
+            store.upsert_many([(result["File Path"], result["ENDPOINTS"], result["Individual"]) for result in analyzed], manifest)
+        unwritten.clear()
+
+    def collect(index, file_results):
+        results[index] = file_results
+        for result in file_results:
+            profiler.merge(result["profile"])
+            if result["plot"] is not None:
+                render_pool.submit(*result["plot"])
+                result["plot"] = None
+            if result["unchanged"]:
+                logger.info(f"Unchanged {result_name(result)}, kept its stored endpoints")
+            elif result["error"] is None:
+                logger.info(f"Finished {result_name(result)}")
+            elif result["error"] == CANCELLED:
+                logger.info(f"Skipped {result_name(result)} (cancelled)")
+            else:
+                logger.error(f"Failed {result_name(result)}: {result['error']}")
+            if on_result is not None:
+                on_result(index, result)
+        if not file_results[0]["unchanged"]:
+            unwritten.append(index)
+            if len(unwritten) >= CHECKPOINT_FILES:
+                checkpoint()
+
+    # Files to analyze, the others keep their stored endpoints
+    todo = list(range(len(file_params)))
+    unchanged = {}
+    if skip_unchanged:
+        manifest = store.manifest()
+        stored = {}
+        for file_path, endpoints, individual in store.rows():
+            stored.setdefault(file_path, []).append((individual, endpoints))
+        touched = []
+        todo = []
+        for index, (given_path, PARAMS) in enumerate(file_params):
+            is_unchanged, source = check_unchanged(manifest.get(str(given_path)), given_path, PARAMS, options)
+            if is_unchanged and str(given_path) in stored:
+                unchanged[index] = stored[str(given_path)]
+                if source is not None:
+                    touched.append(manifest_entry(given_path, source, PARAMS, options))
+            else:
+                todo.append(index)
+        store.upsert_many([], touched)
+        if unchanged:
+            logger.info(f"{len(unchanged)} files unchanged since they were last analyzed, {len(todo)} to analyze")
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(todo)))
+
+    # The logs of the worker processes go to the log file and console of this process
+    with worker_logging() as logging_kwargs:
+        render_pool = RenderPool(max_workers=PLOT_WORKERS if save_peaks and todo else 0, **logging_kwargs)
+        try:
+            for index, rows in unchanged.items():
+                file_results = []
+                for individual, endpoints in rows:
+                    result = new_result(file_params[index][0], individual)
+                    result["ENDPOINTS"] = endpoints
+                    result["unchanged"] = True
+                    file_results.append(result)
+                collect(index, file_results)
+
+            if max_workers == 1:
+                for index in todo:
+                    given_path, PARAMS = file_params[index]
+                    if cancel_event is not None and cancel_event.is_set():
+                        collect(index, [failed_result(given_path, CANCELLED)])
+                    else:
+                        collect(index, analyze_file(given_path, PARAMS, save_peaks, profile, endpoint_window, save_frames))
+            else:
+                logger.info(f"Analyzing {len(todo)} files with {max_workers} processes")
+                with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, **logging_kwargs) as executor:
+                    futures = {executor.submit(analyze_file, *file_params[index], save_peaks, profile, endpoint_window, save_frames): index
+                               for index in todo}
+                    pending = set(futures)
+                    cancelled = False
+                    while pending:
+                        # With a timeout, so that a cancellation is seen while long files are running
+                        done, pending = concurrent.futures.wait(pending, timeout=CANCEL_POLL_SECONDS,
+                                                                return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            index = futures[future]
+                            if future.cancelled():
+                                file_results = [failed_result(file_params[index][0], CANCELLED)]
+                            else:
+                                try:
+                                    file_results = future.result()
+                                except Exception as e:
+                                    # The worker process itself died (e.g. out of memory)
+                                    file_results = [failed_result(file_params[index][0], f"{type(e).__name__}: {e}")]
+                            collect(index, file_results)
+
+                        if not cancelled and cancel_event is not None and cancel_event.is_set():
+                            cancelled = True
+                            logger.warning("Batch cancelled, waiting for the files already being analyzed")
+                            for future in pending:
+                                future.cancel()
+
+            # Written while the last plots are still rendering
+            checkpoint()
+
+            hits = sum(1 for file_results in results if file_results[0]["cache_hit"] is True)
+            misses = sum(1 for file_results in results if file_results[0]["cache_hit"] is False)
+            results = [result for file_results in results for result in file_results]
+            logger.info(f"Parsed-input cache: {hits} hits, {misses} misses")
+
+            with profiler.stage("store"):
+                store.materialize()
+        finally:
+            render_pool.close()
+
+    return results
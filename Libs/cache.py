@@ -0,0 +1,147 @@
+import hashlib
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+import logging
+
+from . import CACHE_DIR, CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Bump when the content of the cached arrays changes, so that older entries are never used
+CACHE_VERSION = 3 # 3: likelihood columns (float32) are cached too
+
+
+def file_digest(given_path, chunk_size=1 << 20):
+    """
+    sha256 of the content of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(given_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# (path, size, mtime) -> digest, so that a file is hashed once per process
+_digests = {}
+
+def file_state(given_path):
+    """
+    (size, mtime in ns, sha256) of a file, only hashed again when its size or mtime changed
+    """
+    stat = os.stat(given_path)
+    memo_key = (str(Path(given_path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _digests:
+        _digests[memo_key] = file_digest(given_path)
+    return stat.st_size, stat.st_mtime_ns, _digests[memo_key]
+
+
+class ParsedCache():
+    """
+    On-disk cache of the cleaned coordinate arrays of input files, one .npz per file
+    Entries are keyed by the content hash and mtime of the input, so an edited file is parsed again
+    The total size is bounded: the least recently used entries are evicted first
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, given_path):
+        _, mtime_ns, digest = file_state(given_path)
+        return self.directory / f"{digest}-{mtime_ns}-v{CACHE_VERSION}.npz"
+
+    def load(self, given_path):
+        """
+        Returns the cached dict of arrays of given_path, or None
+        """
+
+        entry_path = self.entry_path(given_path)
+
+        try:
+            with np.load(entry_path) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except (FileNotFoundError, OSError, ValueError):
+            self.misses += 1
+            logger.debug(f"Cache miss for {given_path}")
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        self.hits += 1
+        logger.debug(f"Cache hit for {given_path}")
+        return arrays
+
+    def save(self, given_path, arrays):
+
+        entry_path = self.entry_path(given_path)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        # Write then rename, so that concurrent processes never read a partial entry
+        temp_path = self.directory / f".{uuid.uuid4().hex}.tmp.npz"
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, entry_path)
+
+        self.evict()
+
+    def entry_paths(self):
+        """
+        The cache entries, without the temporary files that save() is still writing (".<uuid>.tmp.npz")
+        """
+        if not self.directory.exists():
+            return []
+        return [entry_path for entry_path in self.directory.glob("*.npz") if not entry_path.name.startswith(".")]
+
+    def evict(self):
+
+        entries = []
+        for entry_path in self.entry_paths():
+            try:
+                stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                entry_path.unlink()
+                logger.debug(f"Evicted {entry_path} from the cache")
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        entries = self.entry_paths()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(entry.stat().st_size for entry in entries if entry.exists()),
+        }
+
+
+_default_cache = None
+
+def get_parsed_cache():
+    """
+    Cache shared by every Analyzer of this process
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ParsedCache()
+    return _default_cache
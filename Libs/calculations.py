@@ -1,9 +1,26 @@
+import importlib.util
+
 import numpy as np
 
 import logging
 
+from . import PEAK_FINDER_BACKEND, EXCLUDE_FRAMES_FROM_EDGE, TOLERANCE_SWEEP, ALLOWED_DECIMALS
+from . import HRV_RESAMPLE_HZ, HRV_WELCH_SECONDS, HRV_BANDS, LIKELIHOOD_THRESHOLD, INTERPOLATE_MAX_GAP
+
+# numba itself is only imported when a kernel is first used, it takes longer to import than the rest of Libs
+NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
+
 logger = logging.getLogger(__name__)
 
+_compiled_kernels = {}
+
+def _compiled(kernel):
+    # numba version of kernel, compiled (or loaded from numba's on-disk cache) on first use
+    if kernel not in _compiled_kernels:
+        from numba import njit
+        _compiled_kernels[kernel] = njit(cache=True)(kernel)
+    return _compiled_kernels[kernel]
+
 
 def SDCalculator(nn, rpeaks = None):
     '''
@@ -25,6 +42,220 @@ def SDCalculator(nn, rpeaks = None):
     return SD1, SD2
 
 
+def pack_intervals(nn_arrays):
+    """
+    Packs NN interval arrays of different lengths into (values, offsets): array i is values[offsets[i]:offsets[i + 1]]
+    """
+
+    lengths = np.array([len(nn) for nn in nn_arrays], dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate([np.asarray(nn, dtype=float) for nn in nn_arrays]) if len(lengths) else np.empty(0)
+    return values, offsets
+
+
+def _segment_sums(values, offsets):
+    # np.add.reduceat over values[offsets[i]:offsets[i + 1]], where empty segments sum to 0 instead of repeating an element
+    starts, stops = offsets[:-1], offsets[1:]
+    sums = np.zeros(len(starts))
+    nonempty = stops > starts
+    if nonempty.any():
+        sums[nonempty] = np.add.reduceat(values, starts[nonempty])
+    return sums
+
+
+def _welch_band_powers(values, offsets, resample_hz, welch_seconds, bands):
+    """
+    Power of every band (seconds² per segment) of the NN tachograms of all segments, at once:
+    each tachogram is resampled at resample_hz, cut in half-overlapping Hann windows of welch_seconds,
+    and the periodograms of every window of every segment are computed by one rfft and averaged per segment
+    Segments shorter than one window are nan
+    """
+
+    lengths = np.diff(offsets)
+    segments = len(lengths)
+    nperseg = int(round(welch_seconds * resample_hz))
+    step = nperseg // 2
+    powers = {name: np.full(segments, np.nan) for name in bands}
+    if not len(values) or nperseg < 2:
+        return powers
+
+    # Beat times on one axis: the segments follow each other, so one np.interp resamples all of them
+    times = np.cumsum(values)
+    nonempty = lengths > 0
+    first = np.zeros(segments)
+    last = np.zeros(segments)
+    first[nonempty] = times[offsets[:-1][nonempty]]
+    last[nonempty] = times[offsets[1:][nonempty] - 1]
+    samples = np.where(nonempty, np.floor((last - first) * resample_hz).astype(np.int64) + 1, 0)
+
+    sample_offsets = np.zeros(segments + 1, dtype=np.int64)
+    np.cumsum(samples, out=sample_offsets[1:])
+    grid = np.repeat(first, samples) + (np.arange(sample_offsets[-1]) - np.repeat(sample_offsets[:-1], samples)) / resample_hz
+    tachogram = np.interp(grid, times, values)
+
+    frames = np.where(samples >= nperseg, (samples - nperseg) // step + 1, 0)
+    if not frames.any():
+        return powers
+    frame_starts = np.repeat(sample_offsets[:-1], frames) + step * (np.arange(frames.sum()) - np.repeat(np.cumsum(frames) - frames, frames))
+    windows = tachogram[frame_starts[:, None] + np.arange(nperseg)]
+    windows -= windows.mean(axis=1, keepdims=True)
+
+    # Periodic Hann window and one-sided density scaling, as scipy.signal.welch
+    hann = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(nperseg) / nperseg)
+    spectra = np.abs(np.fft.rfft(windows * hann, axis=1))**2 / (resample_hz * np.sum(hann**2))
+    spectra[:, 1:(nperseg + 1) // 2] *= 2
+
+    has_frames = frames > 0
+    frame_offsets = np.concatenate([[0], np.cumsum(frames[has_frames])])
+    psd = np.add.reduceat(spectra, frame_offsets[:-1], axis=0) / frames[has_frames][:, None]
+
+    frequencies = np.fft.rfftfreq(nperseg, 1 / resample_hz)
+    for name, (low, high) in bands.items():
+        band = (frequencies >= low) & (frequencies < high)
+        powers[name][has_frames] = psd[:, band].sum(axis=1) * (resample_hz / nperseg)
+
+    return powers
+
+
+def HRVCalculator(values, offsets, resample_hz=HRV_RESAMPLE_HZ, welch_seconds=HRV_WELCH_SECONDS, bands=HRV_BANDS):
+    """
+    Heart rate variability of many recordings in one call, from their NN intervals in seconds
+    packed as (values, offsets), see pack_intervals
+    Every metric is a segment-wise reduction over the packed values, there is no loop over recordings
+    Returns a dict of arrays with one value per recording (nan when it has too few intervals):
+    SDNN (sample std), RMSSD, pNN50, triangular index (1/128 s bins) and the LF, HF powers and LF/HF ratio
+    of the Welch spectrum of the tachogram
+    """
+
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    segments = len(lengths)
+    segment_ids = np.repeat(np.arange(segments), lengths)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = _segment_sums(values, offsets) / lengths
+        sdnn = np.sqrt(_segment_sums((values - mean[segment_ids])**2, offsets) / np.maximum(lengths - 1, 0))
+
+        # Successive differences, 0 where the next interval belongs to another recording
+        successive = np.zeros(len(values))
+        successive[:-1] = np.diff(values)
+        successive[offsets[1:][lengths > 0] - 1] = 0
+        pairs = np.maximum(lengths - 1, 0)
+        rmssd = np.sqrt(_segment_sums(successive**2, offsets) / pairs)
+        pnn50 = _segment_sums((np.abs(successive) > 0.05).astype(float), offsets) / pairs * 100
+
+        # Highest bin of each recording's histogram: count the (recording, bin) pairs
+        bins = np.floor(values * 128).astype(np.int64)
+        keys, counts = np.unique(segment_ids * (bins.max(initial=0) + 1) + bins, return_counts=True)
+        key_segments = keys // (bins.max(initial=0) + 1)
+        starts = np.searchsorted(key_segments, np.arange(segments))
+        highest = np.zeros(segments)
+        if len(counts):
+            highest[lengths > 0] = np.maximum.reduceat(counts, starts[lengths > 0])
+        triangular_index = lengths / highest
+
+        powers = _welch_band_powers(values, offsets, resample_hz, welch_seconds, bands)
+
+        metrics = {
+            "SDNN (ms)": sdnn * 1000,
+            "RMSSD (ms)": rmssd * 1000,
+            "pNN50 (%)": pnn50,
+            "Triangular index": triangular_index,
+        }
+        for name, power in powers.items():
+            metrics[f"{name} power (ms^2)"] = power * 1e6
+        if "LF" in powers and "HF" in powers:
+            metrics["LF/HF"] = powers["LF"] / powers["HF"]
+
+    return metrics
+
+
+def hrv_endpoints(metrics, index):
+    """
+    ENDPOINTS entries of recording `index` of an HRVCalculator result
+    """
+
+    return {name: round(float(values[index]), ALLOWED_DECIMALS) for name, values in metrics.items()}
+
+
+def LikelihoodFilter(coords, threshold=LIKELIHOOD_THRESHOLD, max_gap=INTERPOLATE_MAX_GAP):
+    """
+    Masks the x/y of every bodypart in the frames where its likelihood ("heart1_likelihood", ...) is under threshold,
+    and linearly interpolates the masked runs of at most max_gap frames between the tracked frames around them
+    Longer runs, and runs at the start or end of the recording, keep their tracked values
+    All the columns (and individuals) are cleaned together, as one (frames x columns) array
+    Returns (cleaned coords, number of masked points, number of interpolated points); coords without likelihood are returned as they are
+    """
+
+    pairs = [(f"{name[:-len('_likelihood')]}_x", f"{name[:-len('_likelihood')]}_y", name)
+             for name in coords if name.endswith("_likelihood")]
+    pairs = [(x, y, likelihood) for x, y, likelihood in pairs if x in coords and y in coords]
+    if not pairs or threshold is None or threshold <= 0:
+        return coords, 0, 0
+
+    frames = len(coords[pairs[0][0]])
+    values = np.concatenate([np.reshape(coords[column], (frames, -1)) for x, y, _ in pairs for column in (x, y)], axis=1).astype(float)
+    masked = np.concatenate([np.reshape(coords[likelihood], (frames, -1)) < threshold for _, _, likelihood in pairs for _ in (0, 1)], axis=1)
+
+    # Nearest tracked frame before and after every frame, for every column
+    index = np.arange(frames)[:, None]
+    previous = np.maximum.accumulate(np.where(masked, -1, index), axis=0)
+    following = np.minimum.accumulate(np.where(masked, frames, index)[::-1], axis=0)[::-1]
+
+    fill = masked & (previous >= 0) & (following < frames) & (following - previous - 1 <= max_gap)
+    rows, columns = np.nonzero(fill)
+    before = previous[rows, columns]
+    after = following[rows, columns]
+    values[rows, columns] = values[before, columns] + (values[after, columns] - values[before, columns]) * (rows - before) / (after - before)
+
+    cleaned = dict(coords)
+    width = values.shape[1] // (2 * len(pairs))
+    for num, (x, y, _) in enumerate(pairs):
+        shape = np.shape(coords[x])
+        cleaned[x] = np.ascontiguousarray(values[:, 2 * num * width:(2 * num + 1) * width]).reshape(shape)
+        cleaned[y] = np.ascontiguousarray(values[:, (2 * num + 1) * width:(2 * num + 2) * width]).reshape(shape)
+
+    # x and y of a bodypart share their mask
+    return cleaned, int(masked.sum()) // 2, len(rows) // 2
+
+
+def GeometryCalculator(coords, conversion_rate):
+    '''
+    coords is anything indexable by column name ("heart1_x", ...), e.g. a DataFrame or a dict of arrays
+    Returns a dict of contiguous float arrays, one value per frame
+    '''
+
+    def column(name):
+        return np.ascontiguousarray(coords[name], dtype=float)
+
+    h1x, h1y = column("heart1_x"), column("heart1_y")
+    h3x, h3y = column("heart3_x"), column("heart3_y")
+    h5x, h5y = column("heart5_x"), column("heart5_y")
+    h7x, h7y = column("heart7_x"), column("heart7_y")
+
+    # Same operations, in the same order, as the former per-frame loop so the numbers match exactly.
+    # np.float_power squares through libm pow like the old scalar `**2` did, where `array**2` would use x*x
+    LAD_in_pixel = np.sqrt(np.float_power(h5x - h1x, 2) + np.float_power(h5y - h1y, 2))
+    LAD_in_mm = LAD_in_pixel / conversion_rate
+
+    SAD_in_pixel = np.sqrt(np.float_power(h7x - h3x, 2) + np.float_power(h7y - h3y, 2))
+    SAD_in_mm = SAD_in_pixel / conversion_rate
+
+    Heart_Volumes_in_mm3 = 1/6 * np.pi * LAD_in_mm * np.float_power(SAD_in_mm, 2)
+    Heart_Volumes_in_pL = Heart_Volumes_in_mm3 * 10**6
+
+    return {
+        "LAD_in_pixel": LAD_in_pixel,
+        "LAD_in_mm": LAD_in_mm,
+        "SAD_in_pixel": SAD_in_pixel,
+        "SAD_in_mm": SAD_in_mm,
+        "Heart_Volumes_in_mm3": Heart_Volumes_in_mm3,
+        "Heart_Volumes_in_pL": Heart_Volumes_in_pL,
+    }
+
+
 def PeakFinder(progress_bar,
                yvalues,
                tolerance,
@@ -32,24 +263,84 @@ def PeakFinder(progress_bar,
                minMaximaValue = np.nan,
                maxMaximaValue = np.nan,
                excludeOnEdges = False,
+               backend = PEAK_FINDER_BACKEND,
+               minPeakProminence = np.nan,
             ):
 
     xvalues = np.arange(len(yvalues))
 
     # tolerance = np.std(yvalues)
 
-    maxima = find_maxima(yvalues, tolerance, excludeOnEdges, progress_bar)
-    minima = find_minima(yvalues, tolerance, excludeOnEdges, progress_bar)
+    try:
+        maxima_finder, minima_finder = PEAK_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown peak finder backend '{backend}', expected one of {list(PEAK_BACKENDS)}")
+
+    maxima = maxima_finder(yvalues, tolerance, excludeOnEdges, progress_bar)
+    minima = minima_finder(yvalues, tolerance, excludeOnEdges, progress_bar)
+
+    maxima, minima = PeakFilter(yvalues, maxima, minima,
+                                minPeakDistance=minPeakDistance,
+                                minMaximaValue=minMaximaValue,
+                                maxMaximaValue=maxMaximaValue,
+                                minPeakProminence=minPeakProminence,
+                                xvalues=xvalues)
+
+    return xvalues, yvalues, maxima, minima
+
+
+def _filter_set(value):
+    # Unset filters are None (empty GUI entry) or nan
+    return value is not None and not np.isnan(value)
+
+
+def PeakFilter(yvalues,
+               maxima,
+               minima,
+               minPeakDistance = 0,
+               minMaximaValue = np.nan,
+               maxMaximaValue = np.nan,
+               minPeakProminence = np.nan,
+               xvalues = None,
+            ):
+    """
+    Post-filter of detected maxima and minima, every filter is O(n log n) in the number of peaks
+        minMaximaValue: keep maxima higher than this
+        maxMaximaValue: keep minima lower than this (the maximum value of minima)
+        minPeakProminence: keep peaks at least this prominent, see peak_prominence
+        minPeakDistance: drop peaks closer than this (in xvalues, frames by default) to a higher ranked peak
+    None or nan disables a filter. Peaks keep the order (ranking) they are given in
+    """
+
+    if xvalues is None:
+        xvalues = np.arange(len(yvalues))
+
+    detected_maxima = maxima = np.asarray(maxima, dtype=int)
+    detected_minima = minima = np.asarray(minima, dtype=int)
 
-    if minMaximaValue is not np.nan:
-        maxima = trim_peak_height(yvalues, maxima, False)
-    if maxMaximaValue is not np.nan:
-        minima = trim_peak_height(yvalues, minima, True)
-    if minPeakDistance > 0:
+    if _filter_set(minMaximaValue):
+        maxima = trim_peak_height(maxima, yvalues, False, minMaximaValue)
+    if _filter_set(maxMaximaValue):
+        minima = trim_peak_height(minima, yvalues, True, maxMaximaValue)
+    if _filter_set(minPeakProminence):
+        maxima = trim_peak_prominence(maxima, yvalues, detected_minima, False, minPeakProminence)
+        minima = trim_peak_prominence(minima, yvalues, detected_maxima, True, minPeakProminence)
+    if _filter_set(minPeakDistance) and minPeakDistance > 0:
         maxima = trim_peak_distance(maxima, xvalues, minPeakDistance)
         minima = trim_peak_distance(minima, xvalues, minPeakDistance)
 
-    return xvalues, yvalues, maxima, minima
+    return maxima, minima
+
+
+def rank_peaks(positions, yvalues, sign=1):
+    """
+    Peaks given in time order, ranked like find_maxima returns them: highest value first (lowest first with sign = -1)
+    PeakFilter needs this ranking, minPeakDistance keeps the higher ranked peak of two close ones
+    """
+
+    positions = np.asarray(positions, dtype=int)
+    values = sign * np.asarray(yvalues[positions] if len(positions) else [], dtype=float)
+    return positions[np.argsort(values)][::-1]
 
 
 def find_maxima(xx, tolerance, edge_mode, progress_bar):
@@ -140,37 +431,432 @@ def find_minima(xx, tolerance, edge_mode, progress_bar):
     return min_positions
 
 
-def trim_peak_height(positions, minima, yvalues):
-    size1 = len(positions)
-    size2 = 0
-    for i in range(size1):
-        if filtered_height(yvalues[positions[i]], minima):
-            size2 += 1
-        else:
-            break  # positions are sorted by amplitude
-    newpositions = [positions[i] for i in range(size2)]
-    return newpositions
+def _maxima_kernel(xx, tolerance, include_edge, circular, sign):
+    """
+    State machine of find_maxima, written so that it can be compiled by numba
+    sign = -1 finds minima on the fly instead of negating the input
+    Circular mode wraps the index instead of building a tripled copy of the input
+    Returns the plateau-centred maxima positions, in detection order, in the (virtual) tripled index space
+    """
+    orig_len = len(xx)
+    len_x = orig_len * 3 if circular else orig_len
+    max_positions = np.zeros(len_x, dtype=np.int64)
+    max_val = sign * xx[0]
+    min_val = max_val
+    max_pos = 0
+    last_max_pos = -1
+    left_valley_found = include_edge
+    max_count = 0
+    for jj in range(1, len_x):
+        val = sign * xx[jj % orig_len]
+        if val > min_val + tolerance:
+            left_valley_found = True
+        if val > max_val and left_valley_found:
+            max_val = val
+            max_pos = jj
+        if left_valley_found:
+            last_max_pos = max_pos
+        if val < max_val - tolerance and left_valley_found:
+            max_positions[max_count] = max_pos
+            max_count += 1
+            left_valley_found = False
+            min_val = val
+            max_val = val
+        if val < min_val:
+            min_val = val
+            if not left_valley_found:
+                max_val = val
+    if include_edge:
+        if max_count > 0 and max_positions[max_count - 1] != last_max_pos:
+            max_positions[max_count] = last_max_pos
+            max_count += 1
+        elif max_count == 0 and max_val - min_val >= tolerance:
+            max_positions[max_count] = last_max_pos
+            max_count += 1
+    for jj in range(max_count):
+        pos = max_positions[jj]
+        steps = 0
+        while pos < len_x - 1 and xx[pos % orig_len] == xx[(pos + 1) % orig_len]:
+            steps += 1
+            pos += 1
+        max_positions[jj] += steps // 2
+    return max_positions[:max_count]
+
+
+def _find_extrema_fast(xx, tolerance, edge_mode, progress_bar, sign):
+    INCLUDE_EDGE = 0
+    CIRCULAR = 2
+    xx = np.asarray(xx, dtype=float) # no copy for float arrays
+    orig_len = len(xx)
+    if orig_len < 2:
+        return np.empty(0, dtype=int)
+    if tolerance < 0:
+        tolerance = 0
+    include_edge = (edge_mode == INCLUDE_EDGE)
+    circular = (edge_mode == CIRCULAR)
+
+    if NUMBA_AVAILABLE:
+        positions = _compiled(_maxima_kernel)(xx, float(tolerance), include_edge, circular, float(sign))
+    else:
+        # Plain floats are much cheaper to compare than numpy scalars in the interpreted loop
+        positions = _maxima_kernel(xx.tolist(), float(tolerance), include_edge, circular, float(sign))
+
+    if progress_bar != None:
+        progress_bar['value'] = 100
+        progress_bar.update()
+
+    # Rank by value, highest first, exactly like find_maxima
+    values = sign * xx[positions % orig_len]
+    return_arr = positions[np.argsort(values)][::-1].astype(int)
+    if circular:
+        return_arr = return_arr - orig_len
+        return_arr = return_arr[(return_arr >= 0) & (return_arr < orig_len)] # pick maxima from cascade center part
+    return return_arr
+
+
+def find_maxima_fast(xx, tolerance, edge_mode, progress_bar):
+    """
+    Same result as find_maxima, using the numba kernel when numba is installed
+    """
+    return _find_extrema_fast(xx, tolerance, edge_mode, progress_bar, 1)
+
+
+def find_minima_fast(xx, tolerance, edge_mode, progress_bar):
+    """
+    Same result as find_minima, without building a negated copy of xx
+    """
+    return _find_extrema_fast(xx, tolerance, edge_mode, progress_bar, -1)
+
+
+PEAK_BACKENDS = {
+    "python": (find_maxima, find_minima), # reference implementation
+    "fast": (find_maxima_fast, find_minima_fast),
+}
+
+
+def _run_ends(xx):
+    # For every frame, the last frame of the run of equal values it belongs to
+    xx = np.asarray(xx, dtype=float)
+    ends = np.append(np.flatnonzero(xx[1:] != xx[:-1]), len(xx) - 1)
+    return ends[np.searchsorted(ends, np.arange(len(xx)))]
+
+
+def _interval_stats(positions, lower, upper):
+    # count, sum and sum of squares of the intervals between the time-ordered positions in [lower, upper]
+    positions = positions[(positions >= lower) & (positions <= upper)]
+    intervals = np.diff(positions).astype(float)
+    return len(positions), intervals.sum(), np.square(intervals).sum()
+
+
+def _sweep_kernel(xx, run_ends, tolerances, lower, upper):
+    """
+    The include-edge state machine of _maxima_kernel, run for every tolerance in the same pass over xx
+    Instead of the positions, keeps per tolerance the number of (plateau-centred) maxima in [lower, upper]
+    and the sum and sum of squares of the intervals between them
+    """
+    n = len(xx)
+    n_tol = len(tolerances)
+    max_val = np.empty(n_tol)
+    min_val = np.empty(n_tol)
+    max_pos = np.zeros(n_tol, dtype=np.int64)
+    last_max_pos = np.full(n_tol, -1, dtype=np.int64)
+    last_confirmed = np.full(n_tol, -1, dtype=np.int64)
+    left_valley_found = np.ones(n_tol, dtype=np.bool_)
+    max_count = np.zeros(n_tol, dtype=np.int64)
+
+    counts = np.zeros(n_tol, dtype=np.int64)
+    previous = np.full(n_tol, -1, dtype=np.int64)
+    sums = np.zeros(n_tol)
+    squares = np.zeros(n_tol)
+
+    for t in range(n_tol):
+        max_val[t] = xx[0]
+        min_val[t] = xx[0]
+
+    for jj in range(1, n):
+        val = xx[jj]
+        for t in range(n_tol):
+            tolerance = tolerances[t]
+            if val > min_val[t] + tolerance:
+                left_valley_found[t] = True
+            if val > max_val[t] and left_valley_found[t]:
+                max_val[t] = val
+                max_pos[t] = jj
+            if left_valley_found[t]:
+                last_max_pos[t] = max_pos[t]
+            if val < max_val[t] - tolerance and left_valley_found[t]:
+                pos = max_pos[t]
+                last_confirmed[t] = pos
+                max_count[t] += 1
+                pos += (run_ends[pos] - pos) // 2
+                if pos >= lower and pos <= upper:
+                    if previous[t] >= 0:
+                        sums[t] += pos - previous[t]
+                        squares[t] += (pos - previous[t]) ** 2
+                    previous[t] = pos
+                    counts[t] += 1
+                left_valley_found[t] = False
+                min_val[t] = val
+                max_val[t] = val
+            if val < min_val[t]:
+                min_val[t] = val
+                if not left_valley_found[t]:
+                    max_val[t] = val
+
+    # Last maximum, as in include-edge mode
+    for t in range(n_tol):
+        if (max_count[t] > 0 and last_confirmed[t] != last_max_pos[t]) or \
+           (max_count[t] == 0 and max_val[t] - min_val[t] >= tolerances[t]):
+            pos = last_max_pos[t]
+            pos += (run_ends[pos] - pos) // 2
+            if pos >= lower and pos <= upper:
+                if previous[t] >= 0:
+                    sums[t] += pos - previous[t]
+                    squares[t] += (pos - previous[t]) ** 2
+                previous[t] = pos
+                counts[t] += 1
+
+    return counts, sums, squares
+
 
-def filtered_height(height, minima, max_minima_value, min_maxima_value):
+def ToleranceSweeper(yvalues, frame_rate, tolerances=None, exclude=EXCLUDE_FRAMES_FROM_EDGE):
+    """
+    Maxima of yvalues for many tolerances at once, as PeakFinder and Analyzer.finder_df_edge_excluder would find them
+    tolerances default to TOLERANCE_SWEEP (start, stop, count) fractions of the std of yvalues, geometrically spaced
+    Returns a dict of arrays, one value per tolerance:
+        "tolerance", "peaks" (maxima kept after edge exclusion), "Heart rate (BPM)",
+        "interval_cv" (std / mean of the beat intervals, lower is a more regular rhythm)
+    """
+
+    yvalues = np.asarray(yvalues, dtype=float)
+    if tolerances is None:
+        start, stop, count = TOLERANCE_SWEEP
+        tolerances = np.std(yvalues) * np.geomspace(start, stop, count)
+    tolerances = np.asarray(tolerances, dtype=float)
+
+    lower = exclude
+    upper = len(yvalues) - exclude
+
+    if len(yvalues) < 2:
+        counts = np.zeros(len(tolerances), dtype=np.int64)
+        sums = np.zeros(len(tolerances))
+        squares = np.zeros(len(tolerances))
+    elif NUMBA_AVAILABLE:
+        counts, sums, squares = _compiled(_sweep_kernel)(yvalues, _run_ends(yvalues), np.maximum(tolerances, 0), lower, upper)
+    else:
+        # One interpreted pass per tolerance is cheaper than the batched loop without numba
+        stats = np.array([_interval_stats(np.sort(find_maxima_fast(yvalues, tolerance, 0, None)), lower, upper)
+                          for tolerance in tolerances], dtype=float).reshape(-1, 3)
+        counts, sums, squares = stats[:, 0].astype(np.int64), stats[:, 1], stats[:, 2]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intervals = np.maximum(counts - 1, 0)
+        mean = sums / intervals
+        std = np.sqrt(np.maximum(squares / intervals - mean**2, 0))
+        heart_rate = 60 / (mean / frame_rate)
+        interval_cv = std / mean
+
+    return {
+        "tolerance": tolerances,
+        "peaks": counts,
+        "Heart rate (BPM)": heart_rate,
+        "interval_cv": interval_cv,
+    }
+
+
+def suggest_tolerance(sweep, min_peaks=3):
+    """
+    Most stable tolerance of a ToleranceSweeper result:
+    in the longest run of consecutive tolerances that find the same number of peaks (at least min_peaks),
+    the one with the most regular beat intervals
+    Returns None when no tolerance finds min_peaks peaks
+    """
+
+    peaks = sweep["peaks"]
+    best = None # (run length, start, stop)
+    start = 0
+    for stop in range(1, len(peaks) + 1):
+        if stop == len(peaks) or peaks[stop] != peaks[start]:
+            if peaks[start] >= min_peaks and (best is None or stop - start > best[0]):
+                best = (stop - start, start, stop)
+            start = stop
+
+    if best is None:
+        return None
+
+    _, start, stop = best
+    interval_cv = np.nan_to_num(sweep["interval_cv"][start:stop], nan=np.inf)
+    return float(sweep["tolerance"][start + int(np.argmin(interval_cv))])
+
+
+def trim_peak_height(positions, yvalues, minima, limit):
+    """
+    Keeps the maxima higher than limit, or the minima (minima=True) lower than limit
+    """
+    positions = np.asarray(positions, dtype=int)
+    return positions[filtered_height(np.asarray(yvalues)[positions], minima, limit)]
+
+def filtered_height(height, minima, limit):
     if minima:
-        return height < max_minima_value
+        return height < limit
     else:
-        return height > min_maxima_value
+        return height > limit
+
+def peak_prominence(positions, yvalues, opposite, minima=False):
+    """
+    Prominence of each peak over the neighbouring detected peaks of the other kind (opposite):
+    for a maximum, its height above the higher of the minima just before and after it,
+    for a minimum, its depth below the lower of the neighbouring maxima.
+    With a neighbour on one side only, that one is used; with none, the prominence is nan
+    """
+
+    positions = np.asarray(positions, dtype=int)
+    yvalues = np.asarray(yvalues, dtype=float)
+    opposite = np.sort(np.asarray(opposite, dtype=int))
+    if len(opposite) == 0:
+        return np.full(len(positions), np.nan)
+
+    sign = -1 if minima else 1
+    index = np.searchsorted(opposite, positions)
+    left = np.where(index > 0, sign * yvalues[opposite[np.maximum(index - 1, 0)]], np.nan)
+    right = np.where(index < len(opposite), sign * yvalues[opposite[np.minimum(index, len(opposite) - 1)]], np.nan)
+
+    return sign * yvalues[positions] - np.fmax(left, right)
+
+def trim_peak_prominence(positions, yvalues, opposite, minima, min_prominence):
+    """
+    Keeps the peaks with at least min_prominence (see peak_prominence), and those whose prominence is unknown
+    """
+    positions = np.asarray(positions, dtype=int)
+    prominence = peak_prominence(positions, yvalues, opposite, minima)
+    return positions[~(prominence < min_prominence)]
+
+def _range_min(values, starts, stops):
+    # min(values[start:stop]) for every (start, stop), stop > start, with a sparse table
+    table = [values]
+    while 2 ** len(table) <= len(values):
+        half = 2 ** (len(table) - 1)
+        table.append(np.minimum(table[-1][:-half], table[-1][half:]))
+
+    level = np.floor(np.log2(stops - starts)).astype(int)
+    result = np.empty(len(starts), dtype=values.dtype)
+    for k in np.unique(level):
+        selected = level == k
+        result[selected] = np.minimum(table[k][starts[selected]], table[k][stops[selected] - 2 ** k])
+    return result
 
 def trim_peak_distance(positions, xvalues, min_peak_distance):
-    size = len(positions)
-    temp = [0 for _ in range(size)]
-    newsize = 0
-    for i in range(size - 1, -1, -1):
-        pos1 = positions[i]
-        trim = False
-        for j in range(i - 1, -1, -1):
-            pos2 = positions[j]
-            if abs(xvalues[pos2] - xvalues[pos1]) < min_peak_distance:
-                trim = True
-                break
-        if not trim:
-            temp[newsize] = pos1
-            newsize += 1
-    newpositions = [temp[i] for i in range(newsize)]
-    return newpositions
\ No newline at end of file
+    """
+    Drops the peaks that are closer than min_peak_distance to a higher ranked peak (earlier in positions)
+    """
+
+    positions = np.asarray(positions, dtype=int)
+    if len(positions) < 2:
+        return positions
+
+    rank = np.arange(len(positions))
+    x = np.asarray(xvalues)[positions]
+
+    order = np.argsort(x, kind="stable")
+    x_sorted = x[order]
+    # Peaks strictly closer than min_peak_distance, on either side
+    starts = np.searchsorted(x_sorted, x_sorted - min_peak_distance, side="right")
+    stops = np.searchsorted(x_sorted, x_sorted + min_peak_distance, side="left")
+
+    # A peak is kept when it has the best rank of its neighbourhood
+    keep = np.empty(len(positions), dtype=bool)
+    keep[order] = _range_min(rank[order], starts, stops) == rank[order]
+    return positions[keep]
+
+
+def _window_mean(values, lo, hi):
+    """
+    Means of values[lo:hi] for every window, from one cumulative sum (nan for empty windows)
+    Centred on the mean of values, so that long recordings do not lose precision in the sum
+    """
+
+    values = np.asarray(values, dtype=float)
+    lo = np.minimum(lo, len(values))
+    hi = np.clip(hi, lo, len(values))
+    count = hi - lo
+
+    centre = values.mean() if len(values) else 0.0
+    cumulative = np.concatenate([[0.0], np.cumsum(values - centre)])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return centre + (cumulative[hi] - cumulative[lo]) / count
+
+
+def _window_var(values, lo, hi):
+    # Population variance (as np.std) of values[lo:hi] for every window
+    values = np.asarray(values, dtype=float)
+    mean = _window_mean(values, lo, hi)
+    centre = values.mean() if len(values) else 0.0
+    return np.maximum(_window_mean((values - centre)**2, lo, hi) - (mean - centre)**2, 0)
+
+
+def WindowedEndpoints(max_x, max_y, min_x, min_y, short_axis, frame_rate, frames, window_s, step_s=None, based_on="maxima"):
+    """
+    The endpoints of Analyzer.EndPoints_Calculator over windows of window_s seconds starting every step_s seconds
+    (step_s None or equal to window_s gives tumbling windows), from the peaks of the whole recording:
+    max_x/min_x are the sorted frames of the maxima/minima, max_y/min_y their volumes in pL
+    Every endpoint is a difference of cumulative sums between the first and last peak of the window
+    (found with searchsorted), so the cost does not depend on the number of windows
+    Stroke volumes pair the maxima and minima once, over the whole recording
+    Returns a dict of arrays, one row per window; windows with too few beats are nan
+    """
+
+    max_x = np.asarray(max_x, dtype=np.int64)
+    min_x = np.asarray(min_x, dtype=np.int64)
+    max_y = np.asarray(max_y, dtype=float)
+    min_y = np.asarray(min_y, dtype=float)
+    short_axis = np.asarray(short_axis, dtype=float)
+
+    window = max(1, int(round(window_s * frame_rate)))
+    step = window if step_s is None else max(1, int(round(step_s * frame_rate)))
+    starts = np.arange(0, frames - window + 1, step, dtype=np.int64)
+    stops = starts + window
+
+    max_lo, max_hi = np.searchsorted(max_x, starts), np.searchsorted(max_x, stops)
+    min_lo, min_hi = np.searchsorted(min_x, starts), np.searchsorted(min_x, stops)
+
+    edv = _window_mean(max_y, max_lo, max_hi)
+    esv = _window_mean(min_y, min_lo, min_hi)
+
+    # Stroke k is maximum k minus the minimum that follows it
+    paired_minima = min_y[1:] if len(max_x) and len(min_x) and max_x[0] > min_x[0] else min_y
+    stroke_num = min(len(max_y), len(paired_minima))
+    stroke_volume = _window_mean(max_y[:stroke_num] - paired_minima[:stroke_num], max_lo, max_hi)
+
+    # Interval i is between beats i and i + 1, the intervals of a window are those between its beats
+    beats, lo, hi = (max_x, max_lo, max_hi) if based_on == "maxima" else (min_x, min_lo, min_hi)
+    nn = np.diff(beats) / frame_rate
+    heart_rate = np.round(60 / _window_mean(nn, lo, hi - 1), ALLOWED_DECIMALS)
+
+    # Poincaré plot of the intervals, as SDCalculator
+    successive = nn[:-1] - nn[1:]
+    var_x = _window_var(nn, lo, hi - 2)
+    var_successive = _window_var(successive, lo, hi - 2)
+    with np.errstate(invalid="ignore"):
+        sd1 = 0.5 * np.sqrt(2) * np.sqrt(var_successive)
+        sd2 = np.sqrt(2 * var_x - 0.5 * var_successive)
+    sd1[hi - lo < 3] = np.nan
+    sd2[hi - lo < 3] = np.nan
+
+    short_axis_maxima = _window_mean(short_axis[max_x], max_lo, max_hi)
+    short_axis_minima = _window_mean(short_axis[min_x], min_lo, min_hi)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "Window start (s)": starts / frame_rate,
+            "Window end (s)": stops / frame_rate,
+            "Beats": hi - lo,
+            "Average EDV": edv,
+            "Average ESV": esv,
+            "Stroke volume (pL/beat)": stroke_volume,
+            "Heart rate (BPM)": heart_rate,
+            "Cardiac Output (pL/beat)": np.round(stroke_volume * heart_rate, ALLOWED_DECIMALS),
+            "Ejection Fraction (%)": np.round(stroke_volume / edv * 100, int(ALLOWED_DECIMALS/2)),
+            "Shortening Fraction (%)": (short_axis_maxima - short_axis_minima) / short_axis_maxima * 100,
+            "SD1": np.round(sd1, ALLOWED_DECIMALS),
+            "SD2": np.round(sd2, ALLOWED_DECIMALS),
+        }
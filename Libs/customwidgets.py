@@ -5,7 +5,7 @@ from . import MUST_FILL
 
 class ProgressWindow(tkinter.Toplevel):
         
-    def __init__(self, master, title="Analysis Progress", geometry="300x100"):
+    def __init__(self, master, title="Analysis Progress", geometry="300x140", on_cancel=None):
         tkinter.Toplevel.__init__(self, master)
         self.title(title)
         self.geometry(geometry)
@@ -17,10 +17,26 @@ class ProgressWindow(tkinter.Toplevel):
         self.total = ttk.Progressbar(self, length=100, mode='determinate')
         self.total.pack(pady=5)
 
+        self.on_cancel = on_cancel
+        self.cancelled = False
+        if on_cancel is not None:
+            self.cancel_button = tkinter.Button(self, text="Cancel", command=self.cancel)
+            self.cancel_button.pack(pady=5)
+            self.protocol("WM_DELETE_WINDOW", self.cancel)
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.cancel_button.config(state=tkinter.DISABLED)
+        self.total_label["text"] = "Cancelling..."
+        self.on_cancel()
+
     def update_progress(self, value, text="Calculating End Points"):
-        self.total_label["text"] = text
+        # Called from the Tk thread, the main loop redraws the window
+        if not self.cancelled:
+            self.total_label["text"] = text
         self.total["value"] = value
-        self.update()
 
 
 class HeaderRow():
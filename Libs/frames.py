@@ -0,0 +1,164 @@
+import os
+import uuid
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+import logging
+
+from Libs.results import PeakTable
+from Libs.trace import windows
+from . import FRAMES_PATH, FRAMES_FORMAT, FRAMES_CHUNK_ROWS
+
+logger = logging.getLogger(__name__)
+
+SUFFIXES = {"parquet": ".parquet", "feather": ".feather", "npz": ".npz"}
+FLAG_COLUMNS = {"maxima": "Maximum", "minima": "Minimum"}
+
+# pyarrow is imported in the functions using it, so that analysis workers only load it to save frames
+def has_pyarrow():
+    try:
+        import pyarrow # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+_warned_fallback = False
+
+def frames_format(file_format=FRAMES_FORMAT):
+    """
+    The format that will actually be written: "npz" when pyarrow is not installed
+    """
+    global _warned_fallback
+    if file_format not in SUFFIXES:
+        raise ValueError(f"Unknown frames format '{file_format}', expected one of {list(SUFFIXES)}")
+    if file_format != "npz" and not has_pyarrow():
+        if not _warned_fallback:
+            logger.warning(f"pyarrow is not installed, frames are saved as compressed .npz instead of {file_format}")
+            _warned_fallback = True
+        return "npz"
+    return file_format
+
+
+def column_names(geometry):
+    return ["Frame", *geometry, *FLAG_COLUMNS.values()]
+
+
+def frame_column(name, geometry, maxima, minima, start, stop):
+    """
+    Column name of the frames start:stop: the frame number, a geometry trace or the flag of a peak table
+    The peak values are not stored, they are the heart volumes of the flagged frames
+    """
+
+    if name == "Frame":
+        return np.arange(start, stop, dtype=np.int64)
+    if name in geometry:
+        return np.asarray(geometry[name][start:stop], dtype=np.float64)
+
+    table = maxima if name == FLAG_COLUMNS["maxima"] else minima
+    flags = np.zeros(stop - start, dtype=bool)
+    flags[table.between(start, stop - 1).x - start] = True
+    return flags
+
+
+def frame_columns(geometry, maxima, minima, start, stop):
+    """
+    Every column of the frames start:stop, see frame_column
+    """
+    return {name: frame_column(name, geometry, maxima, minima, start, stop) for name in column_names(geometry)}
+
+
+def write_npz(output_path, geometry, maxima, minima, frames, chunk_rows):
+    """
+    Compressed .npz with the columns of frame_columns, as np.savez_compressed writes it,
+    but each column is written chunk_rows frames at a time, so that a memory-mapped trace is never loaded whole
+    """
+
+    with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as npz:
+        for name in column_names(geometry):
+            dtype = frame_column(name, geometry, maxima, minima, 0, 0).dtype
+            with npz.open(f"{name}.npy", "w", force_zip64=True) as file:
+                np.lib.format.write_array_header_1_0(file, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                                            "fortran_order": False, "shape": (frames,)})
+                for start, stop in windows(frames, chunk_rows):
+                    file.write(frame_column(name, geometry, maxima, minima, start, stop).tobytes())
+
+
+def save_frames(core_name, geometry, maxima, minima, output_dir=FRAMES_PATH, file_format=FRAMES_FORMAT, chunk_rows=FRAMES_CHUNK_ROWS):
+    """
+    Write the per-frame traces of GeometryCalculator (geometry, possibly memory-mapped) and the maxima/minima PeakTables
+    of a recording to one compressed columnar file, f"{output_dir}/{core_name}.parquet" (or .feather)
+    Parquet row groups and Feather record batches hold chunk_rows frames, so long traces are written a chunk at a time
+    Without pyarrow, a compressed .npz with the same columns is written instead, also a chunk at a time
+    Returns the path of the file, see load_frames
+    """
+
+    file_format = frames_format(file_format)
+    output_path = Path(output_dir) / f"{core_name}{SUFFIXES[file_format]}"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    frames = len(next(iter(geometry.values())))
+
+    # Write then rename, so that a reader never sees a partial file
+    temp_path = output_path.parent / f".{uuid.uuid4().hex}.tmp{SUFFIXES[file_format]}"
+    try:
+        if file_format == "npz":
+            write_npz(temp_path, geometry, maxima, minima, frames, chunk_rows)
+        else:
+            import pyarrow as pa
+
+            chunks = (pa.table(frame_columns(geometry, maxima, minima, start, stop)) for start, stop in windows(frames, chunk_rows))
+            first = next(chunks, None)
+            if first is None: # no frames, the file still gets its columns
+                first = pa.table(frame_columns(geometry, maxima, minima, 0, 0))
+            if file_format == "parquet":
+                import pyarrow.parquet as pq
+
+                with pq.ParquetWriter(temp_path, first.schema, compression="zstd") as writer:
+                    for table in (first, *chunks):
+                        writer.write_table(table, row_group_size=chunk_rows)
+            else:
+                options = pa.ipc.IpcWriteOptions(compression="zstd")
+                with pa.ipc.new_file(temp_path, first.schema, options=options) as writer:
+                    for table in (first, *chunks):
+                        writer.write_table(table, max_chunksize=chunk_rows)
+        os.replace(temp_path, output_path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+    logger.info(f"Saved {frames} frames to {output_path}")
+    return str(output_path)
+
+
+def load_frames(given_path):
+    """
+    Load a file of save_frames, without the DeepLabCut input
+    Returns (traces, maxima, minima): a dict of arrays with the Frame column and every geometry trace
+    (pd.DataFrame(traces) for a table), and the two PeakTables the endpoints were computed from
+    """
+
+    given_path = Path(given_path)
+
+    if given_path.suffix == SUFFIXES["npz"]:
+        with np.load(given_path) as npz:
+            columns = {name: npz[name] for name in npz.files}
+    elif given_path.suffix in (SUFFIXES["parquet"], SUFFIXES["feather"]):
+        if given_path.suffix == SUFFIXES["parquet"]:
+            import pyarrow.parquet as pq
+            table = pq.read_table(given_path)
+        else:
+            import pyarrow.feather as feather
+            table = feather.read_table(given_path)
+        columns = {name: table.column(name).to_numpy() for name in table.column_names}
+    else:
+        raise ValueError(f"Unknown frames file {given_path}, expected one of {list(SUFFIXES.values())}")
+
+    tables = {}
+    for kind, flag_column in FLAG_COLUMNS.items():
+        positions = np.flatnonzero(columns.pop(flag_column))
+        tables[kind] = PeakTable(columns["Frame"][positions], columns["Heart_Volumes_in_pL"][positions])
+
+    return columns, tables["maxima"], tables["minima"]
@@ -0,0 +1,374 @@
+import io
+import itertools
+import csv
+import time
+from collections import deque
+
+import numpy as np
+
+import logging
+
+from Libs.calculations import GeometryCalculator, SDCalculator, LikelihoodFilter
+from Libs.reader import Reader, is_likelihood
+from . import ALLOWED_DECIMALS, EXCLUDE_FRAMES_FROM_EDGE, HEART_BODYPARTS, LIVE_WINDOW_BEATS, LIVE_READ_SIZE
+from . import LIKELIHOOD_THRESHOLD, INTERPOLATE_MAX_GAP
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalExtremaFinder():
+    """
+    The state machine of find_maxima, fed one chunk at a time
+    Keeps only its state between chunks, so memory does not grow with the length of the recording
+    Confirmed positions, after the same plateau centring, are the ones find_maxima returns on the whole trace
+    (find_maxima sorts them by value, here they come out in time order)
+    sign = -1 finds minima, like find_minima
+    """
+
+    def __init__(self, tolerance, sign=1, edge_mode=0):
+        INCLUDE_EDGE = 0
+        CIRCULAR = 2
+        if edge_mode == CIRCULAR:
+            raise ValueError("Circular edge mode needs the whole trace, it can't be used incrementally")
+
+        self.tolerance = max(tolerance, 0)
+        self.sign = sign
+        self.include_edge = (edge_mode == INCLUDE_EDGE)
+
+        self.length = 0 # number of values fed so far
+        self.prev = None # last raw value
+
+        self.max_val = None
+        self.min_val = None
+        self.max_pos = 0
+        self.last_max_pos = -1
+        self.left_valley_found = self.include_edge
+        self.max_count = 0
+        self.last_confirmed = None
+
+        # Raw value at, and end of the run of equal values starting at, max_pos / last_max_pos
+        self.max_raw = None
+        self.max_run_end = 0
+        self.last_raw = None
+        self.last_run_end = -1
+
+        # Confirmed (position, value) whose plateau is still going on
+        self.pending = []
+
+    @staticmethod
+    def _centre(pos, run_end):
+        # Same as find_maxima's walk over a plateau: +0.5 per equal neighbour, then int()
+        return pos + (run_end - pos) // 2
+
+    def feed(self, values):
+        """
+        Returns the list of (position, value) confirmed by these values
+        """
+
+        confirmed = []
+        sign = self.sign
+        tolerance = self.tolerance
+
+        for raw in np.asarray(values, dtype=float).tolist():
+            jj = self.length
+            self.length += 1
+
+            if jj == 0:
+                self.prev = self.max_raw = raw
+                self.max_val = self.min_val = sign * raw
+                continue
+
+            same = (raw == self.prev)
+            self.prev = raw
+
+            # Plateaus
+            if self.pending and not same:
+                confirmed.extend((self._centre(pos, jj - 1), value) for pos, value in self.pending)
+                self.pending = []
+            if same and self.max_run_end == jj - 1:
+                self.max_run_end = jj
+            if same and self.last_run_end == jj - 1:
+                self.last_run_end = jj
+
+            # State machine, as in find_maxima
+            val = sign * raw
+            if val > self.min_val + tolerance:
+                self.left_valley_found = True
+            if val > self.max_val and self.left_valley_found:
+                self.max_val = val
+                self.max_pos = jj
+                self.max_raw = raw
+                self.max_run_end = jj
+            if self.left_valley_found:
+                self.last_max_pos = self.max_pos
+                self.last_raw = self.max_raw
+                self.last_run_end = self.max_run_end
+            if val < self.max_val - tolerance and self.left_valley_found:
+                self.max_count += 1
+                self.last_confirmed = self.max_pos
+                if self.max_run_end == jj:
+                    self.pending.append((self.max_pos, self.max_raw))
+                else:
+                    confirmed.append((self._centre(self.max_pos, self.max_run_end), self.max_raw))
+                self.left_valley_found = False
+                self.min_val = val
+                self.max_val = val
+            if val < self.min_val:
+                self.min_val = val
+                if not self.left_valley_found:
+                    self.max_val = val
+
+        return confirmed
+
+    def finish(self):
+        """
+        End of the recording: returns the remaining (position, value),
+        including the last extremum that find_maxima adds in include-edge mode
+        """
+
+        confirmed = [(self._centre(pos, self.length - 1), value) for pos, value in self.pending]
+        self.pending = []
+
+        if self.length < 2 or not self.include_edge:
+            return confirmed
+
+        if (self.max_count > 0 and self.last_confirmed != self.last_max_pos) or \
+           (self.max_count == 0 and self.max_val - self.min_val >= self.tolerance):
+            confirmed.append((self._centre(self.last_max_pos, self.last_run_end), self.last_raw))
+            self.max_count += 1
+
+        return confirmed
+
+
+class IncrementalLikelihoodFilter():
+    """
+    LikelihoodFilter fed one chunk at a time, returning the same cleaned frames as LikelihoodFilter on the whole recording
+    The frames of a masked run that can still be interpolated (it is open, has a tracked frame before it and is not
+    longer than max_gap yet) are held back until the run ends
+    Keeps only the held frames and the last max_gap + 1 returned ones, the tracked frames a held run can start from
+    """
+
+    def __init__(self, threshold=LIKELIHOOD_THRESHOLD, max_gap=INTERPOLATE_MAX_GAP):
+
+        self.threshold = threshold
+        self.max_gap = max_gap
+
+        self.context = {} # raw columns of the last returned frames
+        self.held = {} # raw columns of the frames not returned yet
+
+    def _held_from(self, window, frames):
+        # First frame of the open masked runs at the end of window that may still be interpolated, frames if none
+        start = frames
+        for name, likelihood in window.items():
+            if not is_likelihood(name):
+                continue
+            tracked = np.flatnonzero(~(likelihood < self.threshold)) # as LikelihoodFilter, NaN is not masked
+            if len(tracked) == 0 or tracked[-1] == frames - 1:
+                continue # never interpolated (no tracked frame before, or longer than max_gap), or not open
+            if frames - 1 - tracked[-1] <= self.max_gap:
+                start = min(start, tracked[-1] + 1)
+        return start
+
+    def feed(self, coords, final=False):
+        """
+        coords is a dict of arrays ("heart1_x", "heart1_likelihood", ...) of new frames
+        Returns the cleaned coords of the frames that can't change anymore, all of them with final
+        """
+
+        if self.threshold is None or self.threshold <= 0 or not any(is_likelihood(name) for name in coords):
+            return coords
+
+        window = {name: np.concatenate([self.context.get(name, values[:0]), self.held.get(name, values[:0]), values])
+                  for name, values in coords.items()}
+        frames = len(next(iter(window.values())))
+        returned = len(next(iter(self.context.values()))) if self.context else 0
+        stop = frames if final else max(self._held_from(window, frames), returned)
+
+        cleaned, _, _ = LikelihoodFilter(window, self.threshold, self.max_gap)
+
+        self.context = {name: values[max(stop - self.max_gap - 1, 0):stop] for name, values in window.items()}
+        self.held = {name: values[stop:] for name, values in window.items()}
+        return {name: values[returned:stop] for name, values in cleaned.items()}
+
+    def finish(self):
+        """
+        End of the recording: returns the held frames, runs still open keep their tracked values
+        """
+
+        if not self.held:
+            return {}
+        return self.feed({name: values[:0] for name, values in self.held.items()}, final=True)
+
+
+class LiveAnalyzer():
+    """
+    Cardiac endpoints of a recording that is still being written
+    Coordinates are fed chunk by chunk, peaks come out as soon as they are confirmed, and the endpoints
+    are recomputed over the last window_beats beats, so memory stays constant
+    Peaks closer than EXCLUDE_FRAMES_FROM_EDGE to either end are dropped, as Analyzer.finder_df_edge_excluder does:
+    that is why a peak is only reported EXCLUDE_FRAMES_FROM_EDGE frames after its position
+    Low likelihood points are masked and interpolated as Analyzer.df_Loader does, see IncrementalLikelihoodFilter:
+    frames of a masked run are only analyzed once the run ends, at most INTERPOLATE_MAX_GAP frames late
+    """
+
+    def __init__(self, PARAMS, tolerance, window_beats=LIVE_WINDOW_BEATS, exclude=EXCLUDE_FRAMES_FROM_EDGE):
+
+        self.PARAMS = PARAMS
+        self.exclude = exclude
+
+        self.likelihood_filter = IncrementalLikelihoodFilter(PARAMS.get("LIKELIHOOD THRESHOLD", LIKELIHOOD_THRESHOLD),
+                                                             PARAMS.get("INTERPOLATE MAX GAP", INTERPOLATE_MAX_GAP))
+        self.maxima_finder = IncrementalExtremaFinder(tolerance, sign=1)
+        self.minima_finder = IncrementalExtremaFinder(tolerance, sign=-1)
+
+        self.frames = 0
+        self.held = deque() # (frame, kind, value) waiting to be far enough from the end of the recording
+
+        self.maxima = deque(maxlen=window_beats + 1) # (frame, value)
+        self.minima = deque(maxlen=window_beats + 1)
+
+        self.ENDPOINTS = {}
+
+    def feed(self, coords):
+        """
+        coords is a dict of arrays ("heart1_x", "heart1_likelihood", ...) of new frames
+        Returns the list of newly reported peaks, as dicts
+        """
+
+        return self._analyze(self.likelihood_filter.feed(coords))
+
+    def _analyze(self, coords):
+
+        if not coords:
+            return self._release(self.frames - self.exclude)
+
+        volumes = GeometryCalculator(coords, self.PARAMS["CONVERSION RATE"])["Heart_Volumes_in_pL"]
+        self.frames += len(volumes)
+
+        self._hold(self.maxima_finder.feed(volumes), "maxima")
+        self._hold(self.minima_finder.feed(volumes), "minima")
+
+        return self._release(self.frames - self.exclude)
+
+    def finish(self):
+        """
+        End of the recording: returns the last peaks
+        """
+
+        events = self._analyze(self.likelihood_filter.finish())
+
+        self._hold(self.maxima_finder.finish(), "maxima")
+        self._hold(self.minima_finder.finish(), "minima")
+
+        events += self._release(self.frames - self.exclude)
+        self.held.clear() # too close to the end
+        return events
+
+    def _hold(self, confirmed, kind):
+        for frame, value in confirmed:
+            if frame >= self.exclude:
+                self.held.append((frame, kind, value))
+
+    def _release(self, last_frame):
+        events = []
+        for frame, kind, value in sorted(self.held):
+            if frame > last_frame:
+                continue
+            (self.maxima if kind == "maxima" else self.minima).append((frame, value))
+            self.update_endpoints()
+            events.append({"kind": kind, "frame": frame, "value": value, "endpoints": dict(self.ENDPOINTS)})
+        self.held = deque(item for item in self.held if item[0] > last_frame)
+        return events
+
+    def update_endpoints(self):
+
+        if len(self.maxima) >= 2:
+            nn_array = np.diff([frame for frame, _ in self.maxima]) / self.PARAMS["FRAME RATE"]
+            self.ENDPOINTS['Heart rate (BPM)'] = round(60 / np.mean(nn_array), ALLOWED_DECIMALS)
+            if len(nn_array) >= 2:
+                sd1, sd2 = SDCalculator(nn_array)
+                self.ENDPOINTS["SD1"] = round(sd1, ALLOWED_DECIMALS)
+                self.ENDPOINTS["SD2"] = round(sd2, ALLOWED_DECIMALS)
+
+        if self.maxima and self.minima:
+            self.ENDPOINTS["Average EDV"] = np.mean([value for _, value in self.maxima])
+            self.ENDPOINTS["Average ESV"] = np.mean([value for _, value in self.minima])
+            self.ENDPOINTS["Stroke volume (pL/beat)"] = self.ENDPOINTS["Average EDV"] - self.ENDPOINTS["Average ESV"]
+            self.ENDPOINTS['Ejection Fraction (%)'] = round(self.ENDPOINTS["Stroke volume (pL/beat)"] / self.ENDPOINTS["Average EDV"] * 100, int(ALLOWED_DECIMALS/2))
+
+
+def tail_dlc_csv(given_path, bodyparts=HEART_BODYPARTS, poll_interval=1.0, idle_timeout=None, stop_event=None, read_size=LIVE_READ_SIZE,
+                 likelihood=True):
+    """
+    Follow a DeepLabCut csv file that is still being written, like `tail -f`
+    Yields a dict of float arrays ("heart1_x", ...) for each batch of complete new rows, read read_size characters at a time,
+    so that attaching to a long file does not load it whole
+    Stops when stop_event is set, or when the file did not grow for idle_timeout seconds (None waits forever)
+    Rows are parsed exactly like Reader.FastCSVReader does, with the likelihood columns ("heart1_likelihood", ...) as float32
+    unless likelihood is False
+    """
+
+    import pandas as pd
+
+    reader = Reader(given_paths=[given_path])
+    columns = None
+    dtypes = None
+    buffer = ""
+    last_growth = time.monotonic()
+
+    def parse(block):
+        df = pd.read_csv(io.StringIO(block), header=None, usecols=list(columns), dtype=dtypes,
+                         engine="c", float_precision="round_trip")
+        return {columns[i]: df[i].to_numpy() for i in columns}
+
+    with open(given_path, newline="") as file:
+        while True:
+            chunk = file.read(read_size)
+            now = time.monotonic()
+            if chunk:
+                buffer += chunk
+                last_growth = now
+
+            # What was already written is read before stopping
+            caught_up = len(chunk) < read_size
+            finished = caught_up and ((stop_event is not None and stop_event.is_set()) or
+                                      (idle_timeout is not None and now - last_growth > idle_timeout))
+
+            # Only complete lines, unless the file is done
+            if finished:
+                block, buffer = buffer, ""
+            else:
+                block, _, buffer = buffer.rpartition("\n")
+                block = block + "\n" if block else ""
+
+            if columns is None and block:
+                header_lines = block.splitlines(keepends=True)
+                if len(header_lines) < 3 and not finished:
+                    buffer = block + buffer
+                    block = ""
+                else:
+                    header = reader.ParseDLCHeader(list(itertools.islice(csv.reader(header_lines[:3]), 3)))
+                    if header is None:
+                        raise ValueError(f"{given_path} does not start with a standard DeepLabCut header")
+                    columns = reader.SelectColumns(header, bodyparts, likelihood)
+                    dtypes = {i: np.float32 if is_likelihood(name) else np.float64 for i, name in columns.items()}
+                    block = "".join(header_lines[3:])
+
+            if block.strip():
+                yield parse(block)
+
+            if finished:
+                return
+            if caught_up:
+                time.sleep(poll_interval)
+
+
+def run_live(given_path, PARAMS, tolerance, poll_interval=1.0, idle_timeout=None, stop_event=None):
+    """
+    Tail given_path and yield the reported peaks of a LiveAnalyzer, see LiveAnalyzer.feed
+    """
+
+    analyzer = LiveAnalyzer(PARAMS, tolerance)
+    for coords in tail_dlc_csv(given_path, poll_interval=poll_interval, idle_timeout=idle_timeout, stop_event=stop_event):
+        yield from analyzer.feed(coords)
+    yield from analyzer.finish()
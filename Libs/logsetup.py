@@ -0,0 +1,128 @@
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+from contextlib import contextmanager
+from pathlib import Path
+
+from . import LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUP_COUNT
+
+FILE_FORMAT = "%(asctime)s %(levelname)-8s [%(processName)s %(pathname)s] %(message)s"
+CONSOLE_FORMAT = "%(asctime)s %(levelname)-8s [%(pathname)s] %(message)s"
+COLORED_CONSOLE_FORMAT = "%(asctime)s %(log_color)s%(levelname)-8s%(reset)s [%(pathname)s] %(message)s"
+
+_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """
+    This is a filter which injects contextual information into the log.
+    """
+
+    def filter(self, record):
+        record.pathname = os.path.basename(record.pathname)  # Modify this line if you want to alter the path
+        return True
+
+
+def setup_logging(level=LOG_LEVEL, log_file=LOG_FILE, console=True, colored=False,
+                  max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """
+    The root logger only puts records on a queue: formatting and writing to the rotating log file
+    and to the console happen on a listener thread, so logging never waits for I/O
+    log_file=None logs to the console only. Can be called again to change the configuration
+    """
+
+    global _listener
+
+    stop_logging()
+
+    handlers = []
+
+    if log_file is not None:
+        Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                                            encoding="utf-8", delay=True)
+        file_handler.setFormatter(logging.Formatter(FILE_FORMAT))
+        handlers.append(file_handler)
+
+    if console:
+        console_handler = logging.StreamHandler()
+        if colored:
+            from colorlog import ColoredFormatter
+            console_handler.setFormatter(ColoredFormatter(COLORED_CONSOLE_FORMAT))
+        else:
+            console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+
+    context_filter = ContextFilter()
+    for handler in handlers:
+        handler.addFilter(context_filter)
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    return _listener
+
+
+def stop_logging():
+    """
+    Writes the queued records and stops the listener thread, called at exit
+    """
+
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+atexit.register(stop_logging)
+
+
+class _Forward(logging.Handler):
+    # Hands a record from a worker process to the logger of the same name in this process
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def setup_worker_logging(log_queue, level):
+    """
+    Initializer of worker processes: every record goes to log_queue, read by the parent, see worker_logging
+    """
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+
+@contextmanager
+def worker_logging():
+    """
+    Routes the logs of the worker processes of a pool to the logging configuration of this process:
+
+        with worker_logging() as logging_kwargs:
+            with ProcessPoolExecutor(max_workers, **logging_kwargs) as executor:
+                ...
+
+    Records keep the name of the process they come from (%(processName)s in the log file)
+    """
+
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, _Forward())
+    listener.start()
+    try:
+        yield {"initializer": setup_worker_logging, "initargs": (log_queue, logging.getLogger().getEffectiveLevel())}
+    finally:
+        listener.stop()
+        log_queue.close()
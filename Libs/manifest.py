@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import logging
+
+from Libs.cache import file_state
+
+logger = logging.getLogger(__name__)
+
+_code_version = None
+
+def code_version():
+    """
+    sha256 of the sources of Libs, so that endpoints computed by another version of the code are not reused
+    """
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        for source_path in sorted(Path(__file__).parent.glob("*.py")):
+            digest.update(source_path.name.encode())
+            digest.update(source_path.read_bytes())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def params_key(PARAMS):
+    # Sorted, and with 30 and 30.0 alike, so that the same PARAMS always give the same string
+    PARAMS = {name: float(value) if isinstance(value, int) and not isinstance(value, bool) else value
+              for name, value in PARAMS.items()}
+    return json.dumps(PARAMS, sort_keys=True, default=str)
+
+
+def options_key(save_peaks, endpoint_window, save_frames=False):
+    """
+    The batch options that change what is saved for a file, besides its endpoints
+    """
+    return json.dumps({"save_peaks": bool(save_peaks),
+                       "endpoint_window": None if endpoint_window is None else [float(value) for value in endpoint_window],
+                       "save_frames": bool(save_frames)})
+
+
+def manifest_entry(given_path, source, PARAMS, options):
+    """
+    Manifest entry of a file analyzed from source, its (size, mtime in ns, sha256) before the analysis (cache.file_state)
+    """
+    size, mtime_ns, sha256 = source
+    return {"file_path": str(given_path), "size": size, "mtime_ns": mtime_ns, "sha256": sha256,
+            "params": params_key(PARAMS), "options": options, "code_version": code_version()}
+
+
+def check_unchanged(entry, given_path, PARAMS, options):
+    """
+    Returns (unchanged, source):
+    unchanged if the file, PARAMS, options and code are the ones of its manifest entry (None if the file was never recorded),
+    source is the new (size, mtime in ns, sha256) of a file whose content is unchanged but whose mtime is not, None otherwise
+    The file is only hashed when its size is unchanged but its mtime is not
+    """
+
+    if entry is None or entry["code_version"] != code_version():
+        return False, None
+    if entry["params"] != params_key(PARAMS) or entry["options"] != options:
+        return False, None
+
+    try:
+        stat = os.stat(given_path)
+    except OSError:
+        return False, None
+
+    if stat.st_size != entry["size"]:
+        return False, None
+    if stat.st_mtime_ns == entry["mtime_ns"]:
+        return True, None
+
+    source = file_state(given_path)
+    if source[2] != entry["sha256"]:
+        return False, None
+    logger.debug(f"{given_path} was touched but its content is unchanged")
+    return True, source
@@ -0,0 +1,177 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+import logging
+
+from . import PROFILING_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# Returned by every stage of a disabled Profiler, so that profiling costs nothing when off
+_NULL_STAGE = nullcontext()
+
+
+class _Stage():
+
+    def __init__(self, profiler, name, given_path):
+        self.profiler = profiler
+        self.name = name
+        self.given_path = given_path
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.parent = profiler._stack[-1] if profiler._stack else None
+        self.child_peak = 0
+
+        if profiler.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                profiler._started_tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            # reset_peak would lose the peak of the enclosing stage so far
+            if self.parent is not None:
+                self.parent.child_peak = max(self.parent.child_peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = current
+
+        profiler._stack.append(self)
+        self.start_time = time.time()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+
+        profiler = self.profiler
+        profiler._stack.pop()
+
+        peak_bytes = None
+        if profiler.trace_memory and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            if self.parent is not None:
+                self.parent.child_peak = max(self.parent.child_peak, peak)
+            peak_bytes = peak - self.start_memory
+
+        profiler.records.append({
+            "stage": self.name,
+            "file": None if self.given_path is None else str(self.given_path),
+            "start": self.start_time,
+            "wall_s": wall,
+            "cpu_s": cpu,
+            "peak_bytes": peak_bytes,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        })
+        return False
+
+
+class Profiler():
+    """
+    Wall time, CPU time and peak allocation (tracemalloc) of each stage and each file
+
+        with profiler.stage("df_Loader", given_path):
+            ...
+
+    Records of other processes (e.g. batch workers) are added with merge
+    A disabled profiler records nothing and its stages are a shared no-op context
+    """
+
+    def __init__(self, enabled=PROFILING_ENABLED, trace_memory=True):
+
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.records = []
+
+        self._stack = []
+        self._started_tracing = False
+
+    def stage(self, name, given_path=None):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, given_path)
+
+    def merge(self, records):
+        if self.enabled and records:
+            self.records.extend(records)
+
+    def close(self):
+        """
+        Stops tracemalloc if this profiler started it
+        """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def summary(self):
+        """
+        Totals per stage: calls, wall and CPU seconds, and the largest peak allocation
+        """
+
+        stages = {}
+        for record in self.records:
+            stage = stages.setdefault(record["stage"], {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_bytes": None})
+            stage["calls"] += 1
+            stage["wall_s"] += record["wall_s"]
+            stage["cpu_s"] += record["cpu_s"]
+            if record["peak_bytes"] is not None:
+                stage["peak_bytes"] = max(stage["peak_bytes"] or 0, record["peak_bytes"])
+        return stages
+
+    def to_json(self, output_path):
+        with open(output_path, "w") as file:
+            json.dump({"summary": self.summary(), "records": self.records}, file, indent=2)
+        logger.info(f"Saved profile to {output_path}")
+
+    def to_chrome_trace(self, output_path):
+        """
+        Timeline for chrome://tracing or https://ui.perfetto.dev, one row per process
+        """
+
+        events = [{
+            "name": record["stage"],
+            "cat": "stage",
+            "ph": "X",
+            "ts": record["start"] * 1e6,
+            "dur": record["wall_s"] * 1e6,
+            "pid": record["pid"],
+            "tid": record["tid"],
+            "args": {"file": record["file"], "cpu_s": record["cpu_s"], "peak_bytes": record["peak_bytes"]},
+        } for record in self.records]
+
+        with open(output_path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        logger.info(f"Saved timeline to {output_path}")
+
+
+def profiled(stage_name):
+    """
+    Method decorator: runs the method as a stage of self.profiler, for file self.given_path
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.stage(stage_name, self.given_path):
+                return method(self, *args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+_default_profiler = None
+
+def get_profiler():
+    """
+    Profiler shared by every Analyzer of this process, enabled by PROFILING_ENABLED
+    """
+    global _default_profiler
+    if _default_profiler is None:
+        _default_profiler = Profiler()
+    return _default_profiler
@@ -1,10 +1,11 @@
-import openpyxl
-import pandas as pd
+import csv
+import itertools
 import numpy as np
 
 from pathlib import Path
 
-from Libs.utils import get_core
+from Libs.utils import get_core, pick_data_sheet
+from . import XLSX_CHUNK_ROWS, INDIVIDUAL_SEPARATOR
 
 
 import logging
@@ -12,6 +13,40 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def header_rows(header):
+    """
+    Number of header rows of a file with this ParseDLCHeader header: 4 for a multi-animal file, 3 otherwise
+    """
+
+    return 4 if any(INDIVIDUAL_SEPARATOR in bodypart for bodypart, _ in header) else 3
+
+
+def is_likelihood(column):
+    return "likelihood" in str(column).lower()
+
+
+def stack_individuals(coords):
+    """
+    Groups the f"{individual}/{column}" columns of a multi-animal file into one (frames x individuals) array per column
+    Returns (coords, individuals); a single-animal file has individuals None and its coords are returned as they are
+    Individuals without every column of the most complete one (e.g. DeepLabCut's "single" individual) are left out
+    """
+
+    if not any(INDIVIDUAL_SEPARATOR in column for column in coords):
+        return coords, None
+
+    grouped = {}
+    for column, values in coords.items():
+        individual, _, name = column.rpartition(INDIVIDUAL_SEPARATOR)
+        grouped.setdefault(individual, {})[name] = values
+
+    names = list(max(grouped.values(), key=len))
+    individuals = [individual for individual, columns in grouped.items() if all(name in columns for name in names)]
+
+    stacked = {name: np.column_stack([grouped[individual][name] for individual in individuals]) for name in names}
+    return stacked, individuals
+
+
 class Reader():
 
     # def __init__(self, given_dir, suffix=".csv"):
@@ -29,7 +64,7 @@ class Reader():
         self.file_paths = [Path(given_path) for given_path in given_paths]
 
         self.file_paths_dict, self.DUPLICATION = self.NameModifier()
-        logger.debug(f"file_paths_dict: {self.file_paths_dict}")
+        logger.debug("file_paths_dict: %s", self.file_paths_dict)
 
         # self.dfs_dict = {core_name : self.DataCleaner(file_path) for core_name, file_path in self.file_paths_dict.items()}
 
@@ -55,12 +90,12 @@ class Reader():
             core, status = get_core(file)
             statuses[status][core] = file
 
-        logger.debug(f"Current statuses: {statuses}")
+        logger.debug("Current statuses: %s", statuses)
 
         common_cores = set(statuses["raw"].keys()).intersection(set(statuses["filtered"].keys()))
 
         only_raw_cores = set(statuses["raw"].keys()).difference(set(statuses["filtered"].keys()))
-        logger.debug(f"only_raw_cores: {only_raw_cores}")
+        logger.debug("only_raw_cores: %s", only_raw_cores)
 
         for core in only_raw_cores:
             ultilize_files[core] = statuses["raw"][core]
@@ -76,24 +111,154 @@ class Reader():
         return ultilize_files, DUPLICATION
     
 
-    def DataCleaner(self, given_path, sheet_name=None):
+    def ParseDLCHeader(self, rows):
+        """
+        rows are the first 3 or 4 rows of a file, as lists of cells
+        Returns a list of (bodypart, coord) for every column after the index column,
+        or None if they are not a standard DeepLabCut header: scorer / bodyparts / coords,
+        or scorer / individuals / bodyparts / coords for multi-animal projects, whose bodyparts are
+        named f"{individual}/{bodypart}" (see stack_individuals and header_rows)
+        """
+
+        labels = [str(row[0]).strip().lower() for row in rows[:4] if len(row)]
 
-        if given_path.suffix == ".csv":
-            df_whole = pd.read_csv(given_path, header=None)
-        elif given_path.suffix == ".xlsx":
+        if labels == ["scorer", "individuals", "bodyparts", "coords"]:
+            return [(f"{individual}{INDIVIDUAL_SEPARATOR}{bodypart}", str(coord))
+                    for individual, bodypart, coord in zip(rows[1][1:], rows[2][1:], rows[3][1:])]
+
+        if labels[:3] != ["scorer", "bodyparts", "coords"]:
+            return None
+
+        return [(str(bodypart), str(coord)) for bodypart, coord in zip(rows[1][1:], rows[2][1:])]
+
+
+    def SelectColumns(self, header, bodyparts=None, likelihood=False):
+        """
+        {column index: column name} of the x/y columns of the wanted bodyparts (all of them if None),
+        and of their likelihood columns with likelihood=True
+        Same column names as the generic path of DataCleaner, e.g. "heart1_x", or "fish1/heart1_x" in a multi-animal file
+        """
+
+        columns = {}
+        if bodyparts is None:
+            columns[0] = "bodyparts_coords"
+        for i, (bodypart, coord) in enumerate(header, start=1):
+            if "likelihood" in coord.lower() and not likelihood:
+                continue
+            if bodyparts is None or bodypart.rpartition(INDIVIDUAL_SEPARATOR)[2] in bodyparts:
+                columns[i] = f"{bodypart}_{coord}"
+
+        return columns
+
+
+    def DLCHeader(self, given_path):
+        """
+        Standard DeepLabCut header of a csv file, see ParseDLCHeader
+        """
+
+        with open(given_path, newline="") as file:
+            rows = list(itertools.islice(csv.reader(file), 4))
+
+        return self.ParseDLCHeader(rows)
+
+
+    def FastCSVReader(self, given_path, header, bodyparts=None, likelihood=False):
+        """
+        Read only the x/y columns of the wanted bodyparts (all of them if None) straight into float64,
+        and with likelihood=True their likelihood columns into float32
+        """
+
+        import pandas as pd
+
+        columns = self.SelectColumns(header, bodyparts, likelihood)
+        dtypes = {i: np.float32 if is_likelihood(name) else np.float64 for i, name in columns.items()}
+
+        df_whole = pd.read_csv(given_path, header=None, skiprows=header_rows(header), usecols=list(columns), dtype=dtypes,
+                               engine="c", float_precision="round_trip")
+        df_whole.columns = [columns[i] for i in df_whole.columns]
+
+        logger.debug("Read data frame with columns: %s", df_whole.columns)
+
+        return df_whole
+
+
+    def StreamXLSX(self, given_path, sheet_name=None, bodyparts=None, chunk_rows=XLSX_CHUNK_ROWS, likelihood=False):
+        """
+        Open the workbook once, in read-only mode, and stream the rows of its data sheet
+        Standard DeepLabCut sheets go straight into float64 arrays: returns (cleaned data frame, True)
+        Other sheets are returned as they are, for the generic path of DataCleaner: returns (raw data frame, False)
+        """
+
+        import openpyxl
+        import pandas as pd
+
+        wb = openpyxl.load_workbook(given_path, read_only=True, data_only=True)
+        try:
             if sheet_name is None:
-                # Get all sheet names of excel_path
-                wb = openpyxl.load_workbook(given_path)
-                sheet_names = wb.sheetnames
+                sheet_name = pick_data_sheet(wb.sheetnames)
+
+            rows = wb[sheet_name].iter_rows(values_only=True)
+            first_rows = list(itertools.islice(rows, 4))
+
+            header = self.ParseDLCHeader(first_rows)
+            if header is None:
+                return pd.DataFrame(first_rows + list(rows)), False
+            # The 4th row is already data in a single-animal sheet
+            rows = itertools.chain(first_rows[header_rows(header):], rows)
+
+            columns = self.SelectColumns(header, bodyparts, likelihood)
+            indices = list(columns)
+            width = max(indices) + 1
 
-                non_summary_sheets = [sheet_name for sheet_name in sheet_names if "summary" not in sheet_name.lower()]
+            chunks = []
+            chunk = np.empty((chunk_rows, len(indices)))
+            filled = 0
+            for row in rows:
+                if len(row) < width:
+                    row = tuple(row) + (None,) * (width - len(row))
+                # None (empty cell) becomes NaN, numeric strings are converted
+                chunk[filled] = [row[i] for i in indices]
+                filled += 1
+                if filled == chunk_rows:
+                    chunks.append(chunk)
+                    chunk = np.empty((chunk_rows, len(indices)))
+                    filled = 0
+            chunks.append(chunk[:filled])
+        finally:
+            wb.close()
 
-                if len(non_summary_sheets) == 0:
-                    raise Exception("No sheet name that does not contain 'summary'")
-                else:
-                    sheet_name = non_summary_sheets[0]
+        data = np.concatenate(chunks)
 
-            df_whole = pd.read_excel(given_path, sheet_name=sheet_name, header=None)
+        # Read-only worksheets can report empty trailing rows
+        filled_rows = np.flatnonzero(~np.isnan(data).all(axis=1))
+        data = data[:filled_rows[-1] + 1] if len(filled_rows) else data[:0]
+
+        df_whole = pd.DataFrame({name: data[:, num].astype(np.float32 if is_likelihood(name) else np.float64, copy=False)
+                                 for num, name in enumerate(columns.values())})
+
+        logger.debug("Read data frame with columns: %s", df_whole.columns)
+
+        return df_whole, True
+
+
+    def DataCleaner(self, given_path, sheet_name=None, bodyparts=None, likelihood=False):
+        """
+        bodyparts is an optional list of bodyparts to load, e.g. ["heart1", "heart3"], only used for standard DeepLabCut files
+        likelihood=True keeps the likelihood columns ("heart1_likelihood"), as float32 in standard DeepLabCut files
+        """
+
+        import pandas as pd
+
+        if given_path.suffix == ".csv":
+            header = self.DLCHeader(given_path)
+            if header is not None:
+                return self.FastCSVReader(given_path, header, bodyparts, likelihood)
+
+            df_whole = pd.read_csv(given_path, header=None)
+        elif given_path.suffix == ".xlsx":
+            df_whole, cleaned = self.StreamXLSX(given_path, sheet_name, bodyparts, likelihood=likelihood)
+            if cleaned:
+                return df_whole
 
         # if first row contain a cell with "scorer", remove it
         for cell in df_whole.iloc[0]:
@@ -105,33 +270,20 @@ class Reader():
         df_whole = df_whole.reset_index(drop=True)
 
         # Combine the content of row 1 and row 2 into one row, f"{content of row 1} {content of row 2}", if content of row 2 is NaN, then just use content of row 1
-        df_whole.iloc[0] = df_whole.iloc[0].fillna("")
-
-        # iterate through cell in row 0
-        for i, cell in enumerate(df_whole.iloc[0]):
-            cell_below = df_whole.iloc[1][i]
-            if cell_below is np.nan:
-                df_whole.iloc[0][i] = cell
-            else:
-                df_whole.iloc[0][i] = f"{cell}_{cell_below}"
-
-        # drop row 1
-        df_whole = df_whole.drop(1)
-
-        # make row 0 as header
-        df_whole.columns = df_whole.iloc[0]
+        header = [cell if pd.isna(cell_below) else f"{cell}_{cell_below}"
+                  for cell, cell_below in zip(df_whole.iloc[0].fillna(""), df_whole.iloc[1])]
 
-        # drop row 0
-        df_whole = df_whole.drop(0)
+        # drop row 0 and row 1, use the combined header instead
+        df_whole = df_whole.drop([0, 1])
+        df_whole.columns = header
 
         # reset index
         df_whole = df_whole.reset_index(drop=True)
 
-        for column in df_whole.columns:
-            if "likelihood" in column.lower():
-                df_whole = df_whole.drop(column, axis=1)
+        if not likelihood:
+            df_whole = df_whole.drop(columns=[column for column in df_whole.columns if is_likelihood(column)])
 
-        logger.debug(f"Cleaned data frame with columns: {df_whole.columns}")
+        logger.debug("Cleaned data frame with columns: %s", df_whole.columns)
     #     ['bodyparts_coords', 'heart1_x', 'heart1_y', 'heart2_x', 'heart2_y',
     #    'heart3_x', 'heart3_y', 'heart4_x', 'heart4_y', 'heart5_x', 'heart5_y',
     #    'heart6_x', 'heart6_y', 'heart7_x', 'heart7_y', 'heart8_x', 'heart8_y']
@@ -0,0 +1,165 @@
+import concurrent.futures
+import os
+from pathlib import Path
+
+import numpy as np
+
+import logging
+
+from .results import take
+from . import PEAKS_IMG_PATH, PLOT_DPI, PLOT_FORMAT, PLOT_SIZE, PLOT_WORKERS, TRACE_WINDOW_FRAMES
+
+logger = logging.getLogger(__name__)
+
+# matplotlib is imported in render_plot only, so that analysis workers never load it
+
+
+def peaks_plot_path(given_name, file_format=PLOT_FORMAT):
+    return os.path.join(PEAKS_IMG_PATH, f"{given_name}.{file_format}")
+
+
+def decimate_minmax(yvalues, buckets, window=TRACE_WINDOW_FRAMES):
+    """
+    Indices (sorted) of the min and max of yvalues in each of `buckets` equal slices
+    Drawn as a line, they look like the full trace at one bucket per pixel column
+    yvalues is read about `window` frames (whole buckets) at a time, so a memory-mapped trace is never loaded whole
+    """
+
+    length = len(yvalues)
+    if length <= 2 * buckets:
+        return np.arange(length)
+
+    size = -(-length // buckets) # frames per bucket, rounded up
+    window = max(window // size, 1) * size
+
+    indices = []
+    for start in range(0, length, window):
+        chunk = np.asarray(yvalues[start:start + window], dtype=float)
+        count = -(-len(chunk) // size) # buckets in this window, the last one of the trace can be partial
+        padded = np.empty(count * size)
+        padded[:len(chunk)] = chunk
+
+        padded[len(chunk):] = np.inf
+        lows = np.argmin(padded.reshape(count, size), axis=1)
+        padded[len(chunk):] = -np.inf
+        highs = np.argmax(padded.reshape(count, size), axis=1)
+
+        starts = start + np.arange(count) * size
+        indices += [starts + lows, starts + highs]
+
+    return np.unique(np.concatenate(indices))
+
+
+def plot_data(given_values, dpi=PLOT_DPI, size=PLOT_SIZE):
+    """
+    What render_plot draws, from the (xvalues, yvalues, maxima, minima) of Analyzer.Peak_Finder:
+    the trace decimated to the pixel width of the plot, and every peak marker
+    Small enough to be sent to a render process
+    """
+
+    xvalues, yvalues, maxima, minima = given_values
+    maxima = np.asarray(maxima, dtype=int)
+    minima = np.asarray(minima, dtype=int)
+
+    line = decimate_minmax(yvalues, int(size[0] * dpi))
+
+    return {
+        "line": (take(xvalues, line), take(yvalues, line)),
+        "maxima": (take(xvalues, maxima), take(yvalues, maxima)),
+        "minima": (take(xvalues, minima), take(yvalues, minima)),
+    }
+
+
+def render_plot(output_path, data, dpi=PLOT_DPI, file_format=PLOT_FORMAT, size=PLOT_SIZE):
+    """
+    Draws plot_data with the Agg canvas directly (no pyplot, no GUI backend) and saves it
+    """
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=size)
+    FigureCanvasAgg(figure)
+    plot1 = figure.add_subplot(111)
+
+    plot1.plot(*data["line"], label='Data')
+    plot1.plot(*data["maxima"], 'ro', label='Maxima')
+    plot1.plot(*data["minima"], 'bo', label='Minima')
+    plot1.legend()
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    figure.savefig(output_path, dpi=dpi, format=file_format)
+    logger.info(f"Saved peaks plot to {output_path}")
+
+    return output_path
+
+
+def save_peaks(given_name, given_values, dpi=PLOT_DPI, file_format=PLOT_FORMAT):
+    """
+    Decimated peaks plot of one file, saved in this process; skipped if it already exists
+    """
+
+    output_path = peaks_plot_path(given_name, file_format)
+    if os.path.exists(output_path):
+        logger.info(f"{output_path} already exists, skip saving")
+        return output_path
+
+    return render_plot(output_path, plot_data(given_values, dpi), dpi, file_format)
+
+
+class RenderPool():
+    """
+    Renders peak plots in max_workers processes (0 renders in this process), so that plotting
+    does not hold up the analysis
+
+        with RenderPool() as pool:
+            pool.submit(core_name, plot_data(values_for_draw))
+
+    Leaving the block waits for every plot. Failed plots are logged and listed in self.errors
+    initializer and initargs are run in each render process, see logsetup.worker_logging
+    """
+
+    def __init__(self, max_workers=PLOT_WORKERS, dpi=PLOT_DPI, file_format=PLOT_FORMAT, initializer=None, initargs=()):
+
+        self.dpi = dpi
+        self.file_format = file_format
+        self.executor = None
+        if max_workers:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs)
+        self.futures = {}
+        self.errors = {}
+
+    def submit(self, given_name, data):
+        output_path = peaks_plot_path(given_name, self.file_format)
+        if os.path.exists(output_path):
+            logger.info(f"{output_path} already exists, skip saving")
+            return
+
+        if self.executor is None:
+            try:
+                render_plot(output_path, data, self.dpi, self.file_format)
+            except Exception as e:
+                self._failed(output_path, e)
+        else:
+            self.futures[self.executor.submit(render_plot, output_path, data, self.dpi, self.file_format)] = output_path
+
+    def _failed(self, output_path, error):
+        logger.error(f"Could not save peaks plot {output_path}: {type(error).__name__}: {error}")
+        self.errors[output_path] = f"{type(error).__name__}: {error}"
+
+    def close(self):
+        for future in concurrent.futures.as_completed(self.futures):
+            try:
+                future.result()
+            except Exception as e:
+                self._failed(self.futures[future], e)
+        self.futures = {}
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
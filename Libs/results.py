@@ -0,0 +1,75 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+def take(values, positions):
+    """
+    values[positions] for an array, or a range (the x values of a trace) without materializing it
+    """
+
+    positions = np.asarray(positions, dtype=np.int64)
+    if isinstance(values, range):
+        return values.start + values.step * positions
+    return np.asarray(values)[positions]
+
+
+@dataclass
+class PeakTable:
+    """
+    The maxima or minima of a trace: frames (int64, sorted, unique) and values (float64)
+    """
+
+    __slots__ = ("x", "y")
+
+    x: np.ndarray
+    y: np.ndarray
+
+    @classmethod
+    def from_peaks(cls, xvalues, yvalues, positions):
+        """
+        Peak table of the given positions (indices into xvalues/yvalues, in any order)
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        x, first = np.unique(take(xvalues, positions).astype(np.int64), return_index=True) # sorted frames, each once
+        return cls(x, take(yvalues, positions[first]).astype(np.float64))
+
+    def __len__(self):
+        return len(self.x)
+
+    def between(self, lower, upper):
+        """
+        The peaks with lower <= frame <= upper
+        """
+
+        start = np.searchsorted(self.x, lower, side="left")
+        stop = np.searchsorted(self.x, upper, side="right")
+        return PeakTable(self.x[start:stop], self.y[start:stop])
+
+    def to_df(self, kind="maxima"):
+        """
+        DataFrame with the X_maxima/Y_maxima (or X_minima/Y_minima) columns of utils.make_df
+        """
+
+        import pandas as pd
+
+        return pd.DataFrame({f"X_{kind}": self.x, f"Y_{kind}": self.y})
+
+
+@dataclass
+class AnalysisResult:
+    """
+    Arrays of one analyzed recording, or individual of a multi-animal recording (None otherwise):
+    per-frame heart volume (pL) and axis length (mm, Analyzer.short_axis), the peak tables the endpoints were computed from, and the endpoints
+    """
+
+    __slots__ = ("given_path", "individual", "volume", "short_axis", "maxima", "minima", "endpoints")
+
+    given_path: str
+    individual: object
+    volume: np.ndarray
+    short_axis: np.ndarray
+    maxima: PeakTable
+    minima: PeakTable
+    endpoints: dict
@@ -0,0 +1,263 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+import logging
+
+from . import STORE_PATH, SUMMARY_PATH
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS_TABLE = """CREATE TABLE IF NOT EXISTS {table} (
+                         file_path TEXT NOT NULL,
+                         individual TEXT NOT NULL DEFAULT '',
+                         endpoints TEXT NOT NULL,
+                         updated_at REAL NOT NULL,
+                         PRIMARY KEY (file_path, individual)
+                     )"""
+
+# Position of every file in the summary, in the order the files were first given (see reserve)
+ORDER_TABLE = """CREATE TABLE IF NOT EXISTS file_order (
+                     position INTEGER PRIMARY KEY,
+                     file_path TEXT NOT NULL UNIQUE
+                 )"""
+
+# One row per file: the state of the input and the settings its stored endpoints were computed with, see Libs/manifest.py
+MANIFEST_TABLE = """CREATE TABLE IF NOT EXISTS manifest (
+                        file_path TEXT PRIMARY KEY,
+                        size INTEGER NOT NULL,
+                        mtime_ns INTEGER NOT NULL,
+                        sha256 TEXT NOT NULL,
+                        params TEXT NOT NULL,
+                        options TEXT NOT NULL,
+                        code_version TEXT NOT NULL,
+                        updated_at REAL NOT NULL
+                    )"""
+
+
+def _to_builtin(value):
+    # numpy scalars are not JSON serializable
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+class EndpointStore():
+    """
+    Endpoints of every analyzed file, in an SQLite database indexed by file path and individual
+    (the individual is "" for single-animal files, and None in the API)
+    Writing a file's endpoints is one indexed upsert, whatever the number of files already stored
+    Several processes can write at the same time: SQLite serializes the writers (WAL journal, busy timeout)
+    The Excel summary is only written by materialize(), with the files in the order they were first given to reserve() or upsert_many()
+    The manifest table records what the endpoints of each file were computed from, so that unchanged files can be skipped
+    """
+
+    def __init__(self, path=STORE_PATH, summary_path=SUMMARY_PATH, timeout=60):
+
+        self.path = Path(path)
+        self.summary_path = Path(summary_path)
+        self.timeout = timeout
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        connection = self._connect()
+        try:
+            is_new = connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='endpoints'").fetchone() is None
+            if is_new:
+                connection.execute(ENDPOINTS_TABLE.format(table="endpoints"))
+            else:
+                self._migrate(connection)
+            connection.execute(MANIFEST_TABLE)
+            self._order_existing(connection)
+        finally:
+            connection.close()
+
+        if is_new and self.summary_path.exists():
+            self.import_summary()
+
+    def _migrate(self, connection):
+        # Stores written before multi-animal support have one row per file, keyed by file_path only
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(endpoints)")]
+        if "individual" in columns:
+            return
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(ENDPOINTS_TABLE.format(table="endpoints_migrated"))
+            connection.execute("""INSERT INTO endpoints_migrated (file_path, individual, endpoints, updated_at)
+                                  SELECT file_path, '', endpoints, updated_at FROM endpoints ORDER BY rowid""")
+            connection.execute("DROP TABLE endpoints")
+            connection.execute("ALTER TABLE endpoints_migrated RENAME TO endpoints")
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        logger.info(f"Migrated {self.path} to one row per individual")
+
+    def _order_existing(self, connection):
+        # Stores written before the file_order table keep the order their rows were added in
+        if connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='file_order'").fetchone() is not None:
+            return
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(ORDER_TABLE)
+            connection.execute("""INSERT OR IGNORE INTO file_order (file_path)
+                                  SELECT file_path FROM endpoints GROUP BY file_path ORDER BY MIN(rowid)""")
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _connect(self):
+        # Autocommit mode, transactions are opened explicitly
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def reserve(self, file_paths):
+        """
+        Give the files not stored yet their position in the summary, in this order, before their endpoints are written
+        A batch reserves all its files first, so that the summary order does not depend on which file finishes first
+        """
+
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("INSERT OR IGNORE INTO file_order (file_path) VALUES (?)",
+                                   [(str(file_path),) for file_path in file_paths])
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def upsert(self, file_path, endpoints, individual=None):
+        self.upsert_many([(file_path, endpoints, individual)])
+
+    def upsert_many(self, rows, manifest=()):
+        """
+        rows is a list of (file path, endpoints dict, individual), individual None for a single-animal file
+        Existing files keep their position and only the given endpoints are replaced, new files are appended
+        manifest is a list of manifest entries (dicts with the columns of the manifest table but updated_at),
+        written in the same transaction as the endpoints
+        """
+
+        if not rows and not manifest:
+            return
+
+        connection = self._connect()
+        try:
+            # Take the write lock before reading, so that a concurrent writer can't interleave
+            connection.execute("BEGIN IMMEDIATE")
+            for file_path, endpoints, individual in rows:
+                file_path = str(file_path)
+                individual = "" if individual is None else str(individual)
+                name = f"{file_path} ({individual})" if individual else file_path
+                endpoints = {key: _to_builtin(value) for key, value in endpoints.items()}
+                connection.execute("INSERT OR IGNORE INTO file_order (file_path) VALUES (?)", (file_path,))
+                existing = connection.execute("SELECT endpoints FROM endpoints WHERE file_path = ? AND individual = ?",
+                                              (file_path, individual)).fetchone()
+                if existing is None:
+                    logger.info(f"Added Endpoints for {name}")
+                else:
+                    endpoints = {**json.loads(existing[0]), **endpoints}
+                    logger.info(f"Updated Endpoints for {name}")
+                connection.execute("""INSERT INTO endpoints (file_path, individual, endpoints, updated_at) VALUES (?, ?, ?, ?)
+                                      ON CONFLICT(file_path, individual) DO UPDATE SET endpoints = excluded.endpoints, updated_at = excluded.updated_at""",
+                                   (file_path, individual, json.dumps(endpoints), time.time()))
+            for entry in manifest:
+                connection.execute("""INSERT OR REPLACE INTO manifest (file_path, size, mtime_ns, sha256, params, options, code_version, updated_at)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                                   (str(entry["file_path"]), entry["size"], entry["mtime_ns"], entry["sha256"],
+                                    entry["params"], entry["options"], entry["code_version"], time.time()))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def get(self, file_path, individual=None):
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT endpoints FROM endpoints WHERE file_path = ? AND individual = ?",
+                                     (str(file_path), "" if individual is None else str(individual))).fetchone()
+        finally:
+            connection.close()
+        return None if row is None else json.loads(row[0])
+
+    def rows(self):
+        """
+        List of (file path, endpoints dict, individual), in the order the files were first given, see reserve
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute("""SELECT endpoints.file_path, endpoints, individual FROM endpoints
+                                         JOIN file_order ON file_order.file_path = endpoints.file_path
+                                         ORDER BY file_order.position, endpoints.rowid""").fetchall()
+        finally:
+            connection.close()
+        return [(file_path, json.loads(endpoints), individual or None) for file_path, endpoints, individual in rows]
+
+    def manifest(self):
+        """
+        {file path: manifest entry (dict of the columns of the manifest table)} of every recorded file
+        """
+        connection = self._connect()
+        try:
+            cursor = connection.execute("SELECT * FROM manifest")
+            columns = [description[0] for description in cursor.description]
+            entries = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            connection.close()
+        return {entry["file_path"]: entry for entry in entries}
+
+    def to_dataframe(self):
+        """
+        One row per file, and per individual of multi-animal files (the Individual column only exists if there are some)
+        """
+
+        import pandas as pd
+
+        rows = self.rows()
+        if any(individual is not None for _, _, individual in rows):
+            records = [{"File Path": file_path, "Individual": individual, **endpoints} for file_path, endpoints, individual in rows]
+        else:
+            records = [{"File Path": file_path, **endpoints} for file_path, endpoints, _ in rows]
+        return pd.DataFrame.from_records(records)
+
+    def materialize(self, summary_path=None):
+        """
+        Write the whole store to the Excel summary, in one go
+        """
+
+        summary_path = Path(summary_path) if summary_path is not None else self.summary_path
+
+        summary_df = self.to_dataframe()
+        if summary_df.empty:
+            logger.info("No endpoints stored yet, summary file not written")
+            return
+
+        summary_path.parent.mkdir(parents=True, exist_ok=True)
+        summary_df.to_excel(summary_path, index=False)
+        logger.info(f"Updated summary file at {summary_path} ({len(summary_df)} files)")
+
+    def import_summary(self):
+        """
+        Load the rows of an existing Excel summary, so that they are kept when the summary is next materialized
+        """
+
+        import pandas as pd
+
+        summary_df = pd.read_excel(self.summary_path)
+        rows = []
+        for record in summary_df.to_dict(orient="records"):
+            file_path = record.pop("File Path")
+            individual = record.pop("Individual", None)
+            rows.append((file_path, record, None if pd.isna(individual) else individual))
+        self.upsert_many(rows)
+        logger.info(f"Imported {len(rows)} rows from {self.summary_path}")
@@ -0,0 +1,111 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+import logging
+
+from Libs.reader import Reader, header_rows, is_likelihood
+from . import HEART_BODYPARTS, TRACE_SUFFIX, TRACE_CHUNK_ROWS, TRACE_WINDOW_FRAMES
+
+logger = logging.getLogger(__name__)
+
+TRACE_VERSION = 2 # version 1 traces have no likelihood columns
+
+
+def trace_meta_path(trace_path):
+    return Path(f"{trace_path}.json")
+
+
+def convert_to_trace(given_path, trace_path=None, bodyparts=HEART_BODYPARTS, chunk_rows=TRACE_CHUNK_ROWS):
+    """
+    Convert a DeepLabCut csv/xlsx file to a trace file: a (columns x frames) float64 .npy array,
+    so that every column is contiguous on disk, plus a .json sidecar with the column names
+    The likelihood columns are kept, parsed as float32 like Reader.DataCleaner does, for the likelihood filter of Analyzer.df_Loader
+    Csv files are converted chunk by chunk, so the whole table is never held in memory
+    Returns the path of the trace file
+    """
+
+    import pandas as pd
+
+    given_path = Path(given_path)
+    trace_path = Path(trace_path) if trace_path is not None else given_path.with_suffix(TRACE_SUFFIX)
+
+    reader = Reader(given_paths=[given_path])
+    header = reader.DLCHeader(given_path) if given_path.suffix == ".csv" else None
+
+    if header is not None:
+        columns = reader.SelectColumns(header, bodyparts, likelihood=True)
+        dtypes = {i: np.float32 if is_likelihood(name) else np.float64 for i, name in columns.items()}
+
+        # Count the lines first, to size the memory map: blank lines make it larger than the rows actually parsed
+        with open(given_path, "rb") as file:
+            frames = sum(chunk.count(b"\n") for chunk in iter(lambda: file.read(1 << 20), b""))
+            file.seek(-1, 2)
+            if file.read(1) != b"\n":
+                frames += 1
+        frames -= header_rows(header)
+
+        trace = np.lib.format.open_memmap(trace_path, mode="w+", dtype=np.float64, shape=(len(columns), frames))
+        start = 0
+        for chunk in pd.read_csv(given_path, header=None, skiprows=header_rows(header), usecols=list(columns), dtype=dtypes,
+                                 engine="c", float_precision="round_trip", chunksize=chunk_rows):
+            trace[:, start:start + len(chunk)] = chunk.to_numpy(dtype=np.float64).T
+            start += len(chunk)
+        trace.flush()
+        del trace
+        if start < frames:
+            logger.info(f"{frames - start} blank lines in {given_path}, the trace has {start} frames")
+        frames = start
+        names = list(columns.values())
+    else:
+        df = reader.DataCleaner(given_path, bodyparts=bodyparts, likelihood=True)
+        df = df[[column for column in df.columns if any(bodypart in str(column).lower() for bodypart in bodyparts)]]
+        with open(trace_path, "wb") as file: # np.save would append .npy to the path
+            np.save(file, np.ascontiguousarray(df.to_numpy(dtype=np.float64).T))
+        names = [str(column) for column in df.columns]
+        frames = len(df)
+
+    # The frames parsed, the columns of the array can be longer (see open_trace)
+    with open(trace_meta_path(trace_path), "w") as file:
+        json.dump({"version": TRACE_VERSION, "columns": names, "frames": frames, "source": str(given_path)}, file, indent=2)
+
+    logger.info(f"Converted {given_path} to {trace_path}")
+    return trace_path
+
+
+def open_trace(trace_path):
+    """
+    Memory-map a trace file, returns {column name: read-only contiguous array}
+    Nothing is read from disk until the arrays are used
+    """
+
+    with open(trace_meta_path(trace_path)) as file:
+        meta = json.load(file)
+
+    if meta["version"] > TRACE_VERSION:
+        raise ValueError(f"{trace_path} has trace version {meta['version']}, expected {TRACE_VERSION}")
+
+    trace = np.load(trace_path, mmap_mode="r")
+    frames = meta.get("frames", trace.shape[1]) # older sidecars have no frame count
+    return {name: trace[i, :frames] for i, name in enumerate(meta["columns"])}
+
+
+def windows(length, window=TRACE_WINDOW_FRAMES):
+    """
+    (start, stop) of consecutive windows covering range(length)
+    """
+
+    for start in range(0, length, window):
+        yield start, min(start + window, length)
+
+
+def windowed_std(values, window=TRACE_WINDOW_FRAMES):
+    """
+    Population standard deviation (like np.std) of a long array, without a full-length temporary
+    """
+
+    length = len(values)
+    mean = sum(float(values[start:stop].sum()) for start, stop in windows(length, window)) / length
+    squares = sum(float(np.square(values[start:stop] - mean).sum()) for start, stop in windows(length, window))
+    return np.sqrt(squares / length)
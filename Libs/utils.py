@@ -1,21 +1,16 @@
-import pandas as pd
 import logging
-import numpy as np
-import openpyxl
 import os
 
 from pathlib import Path
 
-import tkinter as tk
+# pandas, openpyxl, tkinter and matplotlib are imported where they are used,
+# so that importing Libs is fast and the analysis pipeline can run headless
 
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
-from . import PEAKS_IMG_PATH
+from . import PEAKS_IMG_PATH, PLOT_RENDERER
+from .results import PeakTable, take
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 
 ## IMPORT DF FROM EXCEL ##
@@ -27,22 +22,29 @@ def init_core_folders(project_path):
             os.makedirs(os.path.join(project_path, folder))
     
 
+def pick_data_sheet(sheet_names):
+    """
+    First sheet whose name does not contain "summary"
+    """
+    non_summary_sheets = [sheet_name for sheet_name in sheet_names if "summary" not in sheet_name.lower()]
+
+    if len(non_summary_sheets) == 0:
+        raise Exception("No sheet name that does not contain 'summary'")
+
+    return non_summary_sheets[0]
+
+
 def read_clean_excel(excel_path, sheet_name=None):
 
-    if sheet_name is None:
-        # Get all sheet names of excel_path
-        wb = openpyxl.load_workbook(excel_path)
-        sheet_names = wb.sheetnames
+    import pandas as pd
 
-        i = 0
-        while True:
-            sheet_name = sheet_names[i]
-            if "summary" not in sheet_name.lower():
-                break
-            i += 1
+    # Open the workbook once, in read-only mode, for both the sheet names and the data
+    with pd.ExcelFile(excel_path, engine="openpyxl") as excel_file:
+        if sheet_name is None:
+            sheet_name = pick_data_sheet(excel_file.sheet_names)
 
-    # load into df_whole, header = false
-    df_whole = pd.read_excel(excel_path, sheet_name=sheet_name, header=None)
+        # load into df_whole, header = false
+        df_whole = excel_file.parse(sheet_name=sheet_name, header=None)
 
     # if first row contain a cell with "scorer", remove it
     for cell in df_whole.iloc[0]:
@@ -54,24 +56,12 @@ def read_clean_excel(excel_path, sheet_name=None):
     df_whole = df_whole.reset_index(drop=True)
 
     # Combine the content of row 1 and row 2 into one row, f"{content of row 1} {content of row 2}", if content of row 2 is NaN, then just use content of row 1
-    df_whole.iloc[0] = df_whole.iloc[0].fillna("")
-
-    # iterate through cell in row 0
-    for i, cell in enumerate(df_whole.iloc[0]):
-        cell_below = df_whole.iloc[1][i]
-        if cell_below is np.nan:
-            df_whole.iloc[0][i] = cell
-        else:
-            df_whole.iloc[0][i] = f"{cell}_{cell_below}"
+    header = [cell if pd.isna(cell_below) else f"{cell}_{cell_below}"
+              for cell, cell_below in zip(df_whole.iloc[0].fillna(""), df_whole.iloc[1])]
 
-    # drop row 1
-    df_whole = df_whole.drop(1)
-
-    # make row 0 as header
-    df_whole.columns = df_whole.iloc[0]
-
-    # drop row 0
-    df_whole = df_whole.drop(0)
+    # drop row 0 and row 1, use the combined header instead
+    df_whole = df_whole.drop([0, 1])
+    df_whole.columns = header
 
     # reset index
     df_whole = df_whole.reset_index(drop=True)
@@ -81,36 +71,21 @@ def read_clean_excel(excel_path, sheet_name=None):
 ## MAKE DF FOR SAVING ##
 
 def get_coordinates(values, positions):
-    size = len(positions)
-    cc = [values[positions[i]] for i in range(size)]
-    return cc
+    return take(values, positions)
 
 def make_df(xvalues, yvalues, maxima, minima):
+    """
+    Peak tables sorted by frame, as DataFrames with the X_maxima/Y_maxima and X_minima/Y_minima columns
+    """
 
-    xMaxima = get_coordinates(xvalues, maxima)
-    yMaxima = get_coordinates(yvalues, maxima)
-    xMinima = get_coordinates(xvalues, minima)
-    yMinima = get_coordinates(yvalues, minima)
-    
-    maxima_result =  {xMaxima[i]: yMaxima[i] for i in range(len(xMaxima))}
-    maxima_result = dict(sorted(maxima_result.items()))
-
-    minima_result =  {xMinima[i]: yMinima[i] for i in range(len(xMinima))}
-    minima_result = dict(sorted(minima_result.items()))
-
-    df_max = pd.DataFrame(list(maxima_result.items()),columns = ['X_maxima', 'Y_maxima'])
-    df_max['X_maxima'] = df_max['X_maxima'].astype(int)
-    df_max['Y_maxima'] = df_max['Y_maxima'].astype(float)
-
-    df_min = pd.DataFrame(list(minima_result.items()),columns = ['X_minima', 'Y_minima'])
-    df_min['X_minima'] = df_min['X_minima'].astype(int)
-    df_min['Y_minima'] = df_min['Y_minima'].astype(float)
-
-    return df_max, df_min
+    return PeakTable.from_peaks(xvalues, yvalues, maxima).to_df("maxima"), PeakTable.from_peaks(xvalues, yvalues, minima).to_df("minima")
 
 def append_df_to_excel(filepath, df, sheet_name='Sheet1', startcol=None, startrow=None, col_sep = 0, row_sep = 0,
                        truncate_sheet=False, DISPLAY = False,
                        **to_excel_kwargs):
+    import openpyxl
+    import pandas as pd
+
     # Excel file doesn't exist - saving and exiting
     if not os.path.isfile(filepath):
         logger.info("Excel file doesn't exist - directly export using df.to_excel")
@@ -124,7 +99,7 @@ def append_df_to_excel(filepath, df, sheet_name='Sheet1', startcol=None, startro
         wb = openpyxl.load_workbook(filepath)
         ws = wb[sheet_name]
         row_0 = ws[1]
-        logger.debug(f"Header: {row_0}")
+        logger.debug("Header: %s", row_0)
 
         return
     
@@ -157,7 +132,7 @@ def append_df_to_excel(filepath, df, sheet_name='Sheet1', startcol=None, startro
 
     try:
         row_0 = writer.workbook[sheet_name][1]
-        logger.debug(f"Header: {row_0}")
+        logger.debug("Header: %s", row_0)
     except:
         logger.debug(f"Sheet {sheet_name} doesn't exist")
     
@@ -180,6 +155,8 @@ def append_df_to_excel(filepath, df, sheet_name='Sheet1', startcol=None, startro
 
 def draw_plot(xvalues, yvalues, maxima, minima):
 
+    from matplotlib.figure import Figure
+
     xMaxima = get_coordinates(xvalues, maxima)
     yMaxima = get_coordinates(yvalues, maxima)
     xMinima = get_coordinates(xvalues, minima)
@@ -232,6 +209,11 @@ def draw_peaks(master, given_name, given_values, mode="display"):
 
     assert mode in ["display", "save"]
 
+    if mode == "save" and PLOT_RENDERER == "fast":
+        from Libs.render import save_peaks
+        save_peaks(given_name, given_values)
+        return
+
     xvalues, yvalues, maxima, minima = given_values
 
     figure = draw_plot(xvalues, yvalues, maxima, minima)
@@ -246,6 +228,9 @@ def draw_peaks(master, given_name, given_values, mode="display"):
         logger.info(f"Saved peaks plot to {output_path}")
 
     if mode=="display":
+        import tkinter as tk
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         # Make a top level window
         TOP = tk.Toplevel(master)
         TOP.title("Peaks")
@@ -0,0 +1,235 @@
+"""
+Headless batch runner, for machines without a display
+
+    python cli.py "Data/*.csv" --conversion-rate 2200 --frame-rate 30 --tolerance auto
+    python cli.py Data/plate1 Data/plate2 --conversion-rate 2200 --frame-rate 30 --tolerance 0.1 --workers 16
+    python cli.py Data/long_recording.csv --convert-trace      (then analyze Data/long_recording.trace)
+
+This module must never import tkinter or the TkAgg backend, directly or through Libs
+"""
+
+import argparse
+import glob
+import os
+import sys
+from pathlib import Path
+
+import logging
+
+from Libs import DEFAULT_VALUES, BATCH_WORKERS, SUMMARY_PATH, TRACE_SUFFIX, LOG_LEVEL, LOG_FILE, ENDPOINT_SERIES_PATH
+from Libs import LIKELIHOOD_THRESHOLD, INTERPOLATE_MAX_GAP, FRAMES_PATH
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_SUFFIXES = [".csv", ".xlsx", TRACE_SUFFIX]
+
+
+def collect_files(inputs):
+    """
+    Expand directories (non recursive) and glob patterns into a sorted list of unique input files
+    """
+
+    files = []
+    for given_input in inputs:
+        if os.path.isdir(given_input):
+            candidates = [str(path) for path in Path(given_input).iterdir()]
+        elif glob.has_magic(given_input):
+            candidates = glob.glob(given_input, recursive=True)
+        else:
+            candidates = [given_input]
+
+        for candidate in candidates:
+            if Path(candidate).suffix.lower() in SUPPORTED_SUFFIXES and os.path.isfile(candidate):
+                files.append(candidate)
+            elif not os.path.isdir(given_input) and not glob.has_magic(given_input):
+                logger.warning(f"Skipping {candidate}: not a {' or '.join(SUPPORTED_SUFFIXES)} file")
+
+    return sorted(set(files))
+
+
+def parse_tolerance(value):
+    if value.lower() == "auto":
+        return None
+    return float(value)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Cardiac Performance Analyzer - DLC, headless batch mode")
+    parser.add_argument("inputs", nargs="*",
+                        help="DLC .csv/.xlsx/.trace files, directories or glob patterns")
+    parser.add_argument("--conversion-rate", type=float, default=DEFAULT_VALUES["CONVERSION RATE"],
+                        help="pixels per mm (default: %(default)s)")
+    parser.add_argument("--frame-rate", type=float, default=DEFAULT_VALUES["FRAME RATE"],
+                        help="frames per second (default: %(default)s)")
+    parser.add_argument("--tolerance", type=parse_tolerance, default=None,
+                        help="peak tolerance in pL, or 'auto' to use the std of each volume trace (default: auto)")
+    parser.add_argument("--min-peak-distance", type=float, default=None,
+                        help="drop peaks closer than this many frames to a larger peak")
+    parser.add_argument("--min-maxima-value", type=float, default=None,
+                        help="drop maxima (EDV) below this volume in pL")
+    parser.add_argument("--max-minima-value", type=float, default=None,
+                        help="drop minima (ESV) above this volume in pL (the GUI's maxMaximaValue)")
+    parser.add_argument("--min-peak-prominence", type=float, default=None,
+                        help="drop peaks less prominent than this, in pL, over the neighbouring peaks of the other kind")
+    parser.add_argument("--likelihood-threshold", type=float, default=LIKELIHOOD_THRESHOLD,
+                        help=f"mask the points tracked with a lower DeepLabCut likelihood and interpolate the gaps of up to {INTERPOLATE_MAX_GAP} frames, 0 disables (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS,
+                        help="number of processes (default: every core)")
+    parser.add_argument("--filtered-only", action="store_true",
+                        help="when both raw and _filtered versions of a file are given, only analyze the filtered one")
+    parser.add_argument("--no-plots", action="store_true",
+                        help="do not save the peak plots")
+    parser.add_argument("--no-frames", action="store_true",
+                        help=f"do not save the per-frame traces and peak tables in {FRAMES_PATH}")
+    parser.add_argument("--force", action="store_true",
+                        help="analyze every file again, even those unchanged since they were last analyzed with the same parameters")
+    parser.add_argument("--live", action="store_true",
+                        help="follow a single csv file that is still being written and print each peak and the rolling endpoints as a JSON line (needs a numeric --tolerance)")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="with --live, stop when the file did not grow for this many seconds (default: never)")
+    parser.add_argument("--materialize", action="store_true",
+                        help="only rewrite the summary file from the endpoint store, without analyzing anything")
+    parser.add_argument("--sweep", action="store_true",
+                        help="only try many tolerances on each file and print the peak count, heart rate and interval regularity of each, with the suggested tolerance, as a JSON line per file")
+    parser.add_argument("--profile", default=None, metavar="JSON",
+                        help="save the time and memory of every stage of every file to this file")
+    parser.add_argument("--chrome-trace", default=None, metavar="JSON",
+                        help="save the stages as a timeline for chrome://tracing or ui.perfetto.dev")
+    parser.add_argument("--convert-trace", action="store_true",
+                        help=f"convert the inputs to memory-mapped {TRACE_SUFFIX} files next to them, for recordings too long to load in memory, without analyzing anything")
+    parser.add_argument("--endpoint-window", type=float, nargs="+", default=None, metavar=("SECONDS", "STEP"),
+                        help=f"also save the endpoints over windows of SECONDS every STEP seconds (default step: the window, i.e. tumbling windows) as a csv per file in {ENDPOINT_SERIES_PATH}")
+    parser.add_argument("--log-level", default=LOG_LEVEL, choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG also logs the parameters, file lists and columns of every file (default: %(default)s)")
+    parser.add_argument("--log-file", default=LOG_FILE,
+                        help="rotating log file, the logs of every worker process included (default: %(default)s)")
+    return parser
+
+
+def follow(args):
+    import json
+    from Libs.live import run_live
+
+    if len(args.inputs) != 1 or args.tolerance is None:
+        logger.error("--live needs exactly one csv file and a numeric --tolerance")
+        return 2
+
+    PARAMS = {
+        "CONVERSION RATE": args.conversion_rate,
+        "FRAME RATE": args.frame_rate,
+        "LIKELIHOOD THRESHOLD": args.likelihood_threshold,
+    }
+
+    for event in run_live(args.inputs[0], PARAMS, args.tolerance, idle_timeout=args.idle_timeout):
+        print(json.dumps(event, default=float), flush=True)
+
+    return 0
+
+
+def sweep(args, files):
+    import json
+    import numpy as np
+    from Libs.analyzer import Analyzer
+
+    PARAMS = {
+        "CONVERSION RATE": args.conversion_rate,
+        "FRAME RATE": args.frame_rate,
+    }
+
+    for file in files:
+        analyzer = Analyzer(file, dict(PARAMS))
+        analyzer.df_Loader(get_tolerance=True)
+        for individual in analyzer.Individuals():
+            result = individual.Tolerance_Sweeper()
+            rows = [dict(zip(result, values)) for values in zip(*(np.asarray(column).tolist() for column in result.values()))]
+            line = {"File Path": file, "suggested tolerance": float(individual.tolerance), "sweep": rows}
+            if individual.individual is not None:
+                line["Individual"] = individual.individual
+            print(json.dumps(line), flush=True)
+
+    return 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.endpoint_window is not None and len(args.endpoint_window) > 2:
+        parser.error("--endpoint-window takes SECONDS and an optional STEP")
+
+    from Libs.logsetup import setup_logging
+    setup_logging(level=args.log_level, log_file=args.log_file)
+
+    # Imported here so that --help stays instant
+    from Libs.batch import run_batch, result_name
+    from Libs.profiling import Profiler
+    from Libs.reader import Reader
+    from Libs.utils import init_core_folders
+
+    init_core_folders(os.getcwd())
+
+    if args.materialize:
+        from Libs.store import EndpointStore
+        EndpointStore().materialize()
+        return 0
+
+    if args.live:
+        return follow(args)
+
+    files = collect_files(args.inputs)
+    if not files:
+        logger.error(f"No {' or '.join(SUPPORTED_SUFFIXES)} file found in {args.inputs}")
+        return 2
+
+    if args.sweep:
+        return sweep(args, files)
+
+    if args.convert_trace:
+        from Libs.trace import convert_to_trace
+        for file in files:
+            if Path(file).suffix != TRACE_SUFFIX:
+                convert_to_trace(file)
+        return 0
+
+    if args.filtered_only:
+        files = sorted(str(path) for path in Reader(files).file_paths_dict.values())
+
+    PARAMS = {
+        "CONVERSION RATE": args.conversion_rate,
+        "FRAME RATE": args.frame_rate,
+    }
+    if args.tolerance is not None:
+        PARAMS["TOLERANCE"] = args.tolerance
+    PARAMS.update({
+        "LIKELIHOOD THRESHOLD": args.likelihood_threshold,
+        "minPeakDistance": args.min_peak_distance,
+        "minMaximaValue": args.min_maxima_value,
+        "maxMaximaValue": args.max_minima_value,
+        "minPeakProminence": args.min_peak_prominence,
+    })
+
+    profiler = Profiler(enabled=args.profile is not None or args.chrome_trace is not None)
+
+    results = run_batch([(file, dict(PARAMS)) for file in files],
+                        max_workers=args.workers,
+                        save_peaks=not args.no_plots,
+                        profiler=profiler,
+                        endpoint_window=args.endpoint_window,
+                        skip_unchanged=not args.force,
+                        save_frames=not args.no_frames)
+
+    if args.profile is not None:
+        profiler.to_json(args.profile)
+    if args.chrome_trace is not None:
+        profiler.to_chrome_trace(args.chrome_trace)
+
+    failed = [result for result in results if result["error"] is not None]
+    unchanged = sum(1 for result in results if result["unchanged"])
+    logger.info(f"Analyzed {len(results) - len(failed) - unchanged}/{len(results)} recordings ({unchanged} unchanged), summary written to {SUMMARY_PATH}")
+    for result in failed:
+        logger.error(f"{result_name(result)}: {result['error']}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
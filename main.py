@@ -1,65 +1,25 @@
 import tkinter as tk
 from tkinter import ttk
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
-import os
+import queue
+import threading
+import concurrent.futures
 from pathlib import Path
-from colorlog import ColoredFormatter
 
-from Libs.analyzer import Analyzer
-from Libs.reader import Reader
-from Libs.utils import draw_peaks, get_core
+# Analyzer, run_batch, Reader and draw_peaks are imported where they are first used,
+# so that the window opens before numpy, pandas and matplotlib are loaded
 from Libs.customwidgets import ProgressWindow
-from Libs import ENTRY_NAMES, ENTRY_NAMES_SET1, ENTRY_NAMES_SET2, DEFAULT_VALUES
+from Libs import ENTRY_NAMES, ENTRY_NAMES_SET1, ENTRY_NAMES_SET2, DEFAULT_VALUES, GUI_POLL_MS, SAVE_FRAMES
 
 ###################################################### SETUP LOGGING ######################################################
 
 import logging
-logger = logging.getLogger(__name__)
-
-# save log to Log/log.txt
-Path('Log').mkdir(parents=True, exist_ok=True)
-
-# Configure the logging module
-log_file = 'Log/app.log'
-
-class ContextFilter(logging.Filter):
-    """
-    This is a filter which injects contextual information into the log.
-    """
-
-    def filter(self, record):
-        record.pathname = os.path.basename(record.pathname)  # Modify this line if you want to alter the path
-        return True
-
-# Define the log format with colors
-log_format = "%(asctime)s %(log_color)s%(levelname)-8s%(reset)s [%(pathname)s] %(message)s"
-
-# Create a formatter with colored output
-formatter = ColoredFormatter(log_format)
-
-# Get the root logger
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-
-# Create a filter
-f = ContextFilter()
-
-# Create a file handler to save logs to the file
-file_handler = logging.FileHandler(log_file, mode='a')  # Set the mode to 'a' for append
-file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-8s [%(pathname)s] %(message)s"))
-file_handler.addFilter(f)  # Add the filter to the file handler
-file_handler.setLevel(logging.DEBUG)
-
-# Create a stream handler to display logs on the console with colored output
-stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(formatter)
-stream_handler.addFilter(f)  # Add the filter to the stream handler
-stream_handler.setLevel(logging.DEBUG)
+from Libs.logsetup import setup_logging
+from Libs import LOG_LEVEL, LOG_FILE
 
-# Add the handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+# Rotating Log/app.log and a colored console, written by a listener thread so that the window never waits for the log
+setup_logging(level=LOG_LEVEL, log_file=LOG_FILE, colored=True)
+logger = logging.getLogger(__name__)
 
 #################################################### SETUP DIRECTORIES ###################################################
 
@@ -127,6 +87,9 @@ class Application(tk.Tk):
         self.entries = {name : None for name in ENTRY_NAMES}
         self.files_widgets = {}
 
+        # Analysis runs here, off the Tk thread, see run_in_background
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
 
     def reset_entries(self):
         self.entries = {name : None for name in ENTRY_NAMES}
@@ -145,6 +108,8 @@ class Application(tk.Tk):
             logger.warning('No files selected')
             return False
         
+        from Libs.reader import Reader
+
         temp_reader = Reader(self.selected_files)
 
         if temp_reader.DUPLICATION == False:
@@ -250,10 +215,54 @@ class Application(tk.Tk):
             for param in ENTRY_NAMES_SET1:
                 PARAMS[param] = self.get_current_entry_value(param)
 
-            analyzer = Analyzer(self.selected_files[0], PARAMS)
-            analyzer.df_Loader(get_tolerance=True)
+            file_params = [(self.selected_files[0], PARAMS)]
+
+        else:
+            file_params = []
+            for file in self.selected_files:
+                file_name = Path(file).name
+
+                if not self.entries_checker(self.files_widgets[file_name]):
+                    return
+
+                PARAMS = {}
+                for param in ENTRY_NAMES_SET1:
+                    PARAMS[param] = self.get_current_entry_value(param, file_name=file_name)
+
+                file_params.append((file, PARAMS))
+
+        def work(post, cancel_event):
+            import statistics
+            from Libs.analyzer import Analyzer
+
+            tolerances = {}
+            for index, (file, PARAMS) in enumerate(file_params):
+                if cancel_event.is_set():
+                    break
+                logger.debug(f"Finding tolerance for {file}")
+                post(int(index/len(file_params)*100), f"Finding tolerance for {Path(file).name}")
+
+                analyzer = Analyzer(file, PARAMS)
+                analyzer.df_Loader(get_tolerance=True)
+                # A multi-animal file has one entry: the median of the tolerances of its individuals
+                suggested = []
+                for individual in analyzer.Individuals():
+                    individual.Tolerance_Sweeper()
+                    suggested.append(individual.tolerance)
+
+                tolerances[file] = float(statistics.median(suggested))
+            return tolerances
+
+        self.run_in_background(work, self.show_tolerances, title="Finding Tolerance")
 
-            self.TOLERANCE = analyzer.tolerance
+
+    def show_tolerances(self, tolerances, cancelled):
+
+        if cancelled:
+            return
+
+        if len(self.selected_files) == 1:
+            self.TOLERANCE = tolerances[self.selected_files[0]]
 
             for entry in ENTRY_NAMES_SET2:
                 row = tk.Frame(self.mid_frame)
@@ -268,20 +277,9 @@ class Application(tk.Tk):
 
         else:
             for file in self.selected_files:
-                logger.debug(f"Finding tolerance for {file}")
                 file_name = Path(file).name
 
-                if not self.entries_checker(self.files_widgets[file_name]):
-                    return
-
-                PARAMS = {}
-                for param in ENTRY_NAMES_SET1:
-                    PARAMS[param] = self.get_current_entry_value(param, file_name=file_name)
-
-                analyzer = Analyzer(file, PARAMS)
-                analyzer.df_Loader(get_tolerance=True)
-
-                self.TOLERANCE = analyzer.tolerance
+                self.TOLERANCE = tolerances[file]
 
                 self.files_widgets[file_name]["TOLERANCE"] = tk.Entry(self.files_widgets[file_name]['row'])
                 self.files_widgets[file_name]["TOLERANCE"].pack(side=tk.LEFT, expand=tk.YES, fill=tk.X, padx=5, pady=5)
@@ -291,6 +289,56 @@ class Application(tk.Tk):
         self.analyze_button.config(state=tk.NORMAL)
 
 
+    def run_in_background(self, work, on_done, title="Analysis Progress"):
+        """
+        Runs work(post, cancel_event) on the background executor, so that the window stays responsive
+        work reports progress with post(value, text), which goes through a queue polled every GUI_POLL_MS,
+        and should stop early once cancel_event is set (by the Cancel button)
+        on_done(result, cancelled) then runs on the Tk thread with the return value of work
+        """
+
+        messages = queue.Queue()
+        cancel_event = threading.Event()
+        progress_window = ProgressWindow(self, title=title, on_cancel=cancel_event.set)
+
+        # No other run while this one is going
+        buttons = [self.file_button, self.find_tolerance_button, self.analyze_button, self.display_button]
+        states = [button["state"] for button in buttons]
+        for button in buttons:
+            button.config(state=tk.DISABLED)
+
+        def post(value, text="Calculating End Points"):
+            messages.put((value, text))
+
+        future = self.executor.submit(work, post, cancel_event)
+
+        def poll():
+            try:
+                while True:
+                    progress_window.update_progress(*messages.get_nowait())
+            except queue.Empty:
+                pass
+
+            if not future.done():
+                self.after(GUI_POLL_MS, poll)
+                return
+
+            progress_window.destroy()
+            for button, state in zip(buttons, states):
+                button.config(state=state)
+
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception(f"{title} failed")
+                tk.messagebox.showerror(title='Error', message=f'{type(e).__name__}: {e}\nSee Log/app.log for details')
+                return
+
+            on_done(result, cancel_event.is_set())
+
+        self.after(GUI_POLL_MS, poll)
+
+
     def copy_params_from_first_row(self):
         if self.files_widgets == {}:
             return
@@ -382,56 +430,124 @@ class Application(tk.Tk):
     
     def analyze(self):  
         PARAMS = self.get_all_params()
-
-        PROGRESS_WINDOW = ProgressWindow(self)
+        if PARAMS is None:
+            return
 
         if len(self.selected_files) == 1:
-            analyzer = Analyzer(self.selected_files[0], PARAMS)
-            self.core_name = analyzer.core_name
-            analyzer.df_Loader()
-            self.values_for_draw = analyzer.Peak_Finder()
-            analyzer.EndPoints_Calculator()
-            analyzer.EndPoints_Updater()
+            given_path = self.selected_files[0]
 
-            tk.messagebox.showinfo(title='Success', message=f'Analysis of {Path(self.selected_files[0]).name} is done!')
+            def work(post, cancel_event):
+                from Libs.analyzer import Analyzer
+                from Libs.store import EndpointStore
 
-            # Change text of self.display_button to 'Display & Save Peaks'
-            self.display_button.config(text='Display Peaks')
-            self.display_button.config(state=tk.NORMAL)
+                stages = ["Finding peaks", "Calculating End Points", "Saving End Points"]
+                post(0, "Loading")
+                analyzer = Analyzer(given_path, PARAMS)
+                analyzer.df_Loader()
+
+                # One analyzer per individual of a multi-animal file
+                individuals = analyzer.Individuals()
+                steps = 1 + len(stages) * len(individuals)
+                saved = False
+                try:
+                    for index, individual in enumerate(individuals):
+                        for num, stage in enumerate(stages):
+                            if cancel_event.is_set():
+                                return None
+                            name = stage if individual.individual is None else f"{stage} ({individual.individual})"
+                            post(int((1 + index*len(stages) + num)/steps*100), name)
+                            if stage == "Finding peaks":
+                                individual.Peak_Finder()
+                            elif stage == "Calculating End Points":
+                                individual.EndPoints_Calculator()
+                            else:
+                                # The summary workbook is rewritten once, after the last individual
+                                individual.EndPoints_Updater(materialize=False)
+                                saved = True
+                                if SAVE_FRAMES:
+                                    individual.Save_Frames()
+                finally:
+                    if saved:
+                        EndpointStore().materialize()
+                return individuals
+
+            self.run_in_background(work, self.single_analysis_done)
 
         else:
-            for i, file in enumerate(self.selected_files):
-                file_name = Path(file).name
-                analyzer = Analyzer(file, PARAMS[file_name])
-                analyzer.df_Loader()
-                analyzer.Peak_Finder()
-                analyzer.EndPoints_Calculator()
-                analyzer.EndPoints_Updater()
-                analyzer.SavePeaks()
+            file_params = [(file, PARAMS[Path(file).name]) for file in self.selected_files]
+
+            def work(post, cancel_event):
+                from Libs.batch import run_batch, CANCELLED
+
+                done = set()
+
+                def on_result(index, result):
+                    done.add(index)
+                    name = Path(result["File Path"]).name
+                    if result["error"] is None:
+                        text = f"Finished {name}"
+                    elif result["error"] == CANCELLED:
+                        text = f"Skipped {name}"
+                    else:
+                        text = f"Failed {name}"
+                    post(int(len(done)/len(file_params)*100), text)
+
+                return run_batch(file_params, on_result=on_result, cancel_event=cancel_event)
+
+            self.run_in_background(work, self.batch_analysis_done)
+
+
+    def single_analysis_done(self, individuals, cancelled):
 
-                progress = int((i+1)/len(self.selected_files)*100)
-                PROGRESS_WINDOW.update_progress(progress)
+        if cancelled or individuals is None:
+            tk.messagebox.showinfo(title='Cancelled', message=f'Analysis of {Path(self.selected_files[0]).name} was cancelled')
+            return
+
+        self.analyzed_peaks = [(individual.core_name, individual.values_for_draw) for individual in individuals]
+
+        tk.messagebox.showinfo(title='Success', message=f'Analysis of {Path(self.selected_files[0]).name} is done!')
+
+        # Change text of self.display_button to 'Display & Save Peaks'
+        self.display_button.config(text='Display Peaks')
+        self.display_button.config(state=tk.NORMAL)
+
+
+    def batch_analysis_done(self, results, cancelled):
+        from Libs.batch import CANCELLED
 
+        finished = [result for result in results if result["error"] is None]
+        skipped = [result for result in results if result["error"] == CANCELLED]
+        failed = [Path(result["File Path"]).name for result in results if result["error"] not in (None, CANCELLED)]
+
+        if cancelled:
+            tk.messagebox.showinfo(title='Cancelled', message=f'Batch analysis cancelled: {len(finished)} file(s) done and saved to the summary, {len(skipped)} skipped')
+        elif failed:
+            tk.messagebox.showwarning(title='Done with errors', message=f'Analysis failed for {len(failed)} file(s): {failed}\nSee Log/app.log for details')
+        else:
             tk.messagebox.showinfo(title='Success', message=f'Batch analysis of {len(self.selected_files)} files is done!')
 
-            # Change text of self.display_button to 'Save Peaks'
-            self.display_button.config(text='Save Peaks')
+        # Change text of self.display_button to 'Save Peaks'
+        self.display_button.config(text='Save Peaks')
 
 
 
     def displaypeaks(self):
+
+        from Libs.utils import draw_peaks
         
-        draw_peaks(master=self, 
-                   given_name=self.core_name, 
-                   given_values=self.values_for_draw, 
-                   mode="display")
-        
-        logger.debug(f"Displaying peaks of {self.core_name} is done!")
+        # One plot per individual of a multi-animal file
+        for core_name, values_for_draw in self.analyzed_peaks:
+            draw_peaks(master=self, 
+                       given_name=core_name, 
+                       given_values=values_for_draw, 
+                       mode="display")
+            
+            logger.debug(f"Displaying peaks of {core_name} is done!")
 
-        draw_peaks(master=self, 
-                   given_name=self.core_name, 
-                   given_values=self.values_for_draw, 
-                   mode="save")
+            draw_peaks(master=self, 
+                       given_name=core_name, 
+                       given_values=values_for_draw, 
+                       mode="save")
 
 
 